@@ -2,16 +2,29 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import functools
 import json
+import os
+import time
+from collections import Counter
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from datetime import datetime, timedelta, timezone
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, session, jsonify, abort, stream_with_context, get_flashed_messages
 from flask_moment import Moment
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
+from sqlalchemy import DDL, bindparam
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from flask_wtf import Form
 from forms import *
+from cache import PageCache
+from commands import fyyur_cli
+from logs import setup_logging
+from jobs import BatchJobWorker
+from assets import init_assets
+from sessions import init_sessions
+from images import Image, THUMBNAIL_FORMATS, ThumbnailCache, local_original, render_thumbnail, snap_width
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -19,7 +32,17 @@ from forms import *
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+app.cli.add_command(fyyur_cli)
+init_assets(app)
+init_sessions(app)
+# compiled templates are shared by every worker through the filesystem; see `flask fyyur precompile-templates`
+if app.config['TEMPLATE_BYTECODE_CACHE_DIR']:
+  os.makedirs(app.config['TEMPLATE_BYTECODE_CACHE_DIR'], exist_ok=True)
+  app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR'])
 db = SQLAlchemy(app)
+page_cache = PageCache(app.config['PAGE_CACHE_MAX_ENTRIES'], app.config['PAGE_CACHE_MAX_BYTES'],
+  app.config['PAGE_CACHE_VERSIONS_DIR'], app.config['PAGE_CACHE_MAX_AGE'])
+thumbnail_cache = ThumbnailCache(app.config['THUMBNAIL_CACHE_DIR'], app.config['THUMBNAIL_CACHE_MAX_BYTES'])
 
 # TODO: connect to a local postgresql database
 
@@ -27,6 +50,28 @@ db = SQLAlchemy(app)
 # Models.
 #----------------------------------------------------------------------------#
 
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    name = db.Column(db.String(50), primary_key=True)
+
+@db.event.listens_for(Genre.__table__, 'after_create')
+def insert_genres(target, connection, **kw):
+    # the table holds exactly the form choices, so any submitted genre is a valid key
+    connection.execute(target.insert(), [{'name': genre} for genre in GENRES])
+
+# (genre, id) primary keys: a genre filter is a range scan that also yields rows in id order,
+# so /venues?genre= and /artists?genre= page on the link table's id column
+venue_genres = db.Table('venue_genres',
+    db.Column('genre', db.String(50), db.ForeignKey('Genre.name'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True, index=True),
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('genre', db.String(50), db.ForeignKey('Genre.name'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True, index=True),
+)
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
 
@@ -38,6 +83,18 @@ class Venue(db.Model):
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=venue_genres)
+    # bumped by every edit; see update_versioned()
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # set by delete_venue; the row and its shows are then removed in the background
+    hidden = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    # /venues, /areas and /areas/<state>/<city> read venues in this order;
+    # partial, so it holds exactly the listed venues
+    __table_args__ = (
+        db.Index('ix_Venue_state_city_name', 'state', 'city', 'name', 'id',
+                 postgresql_where=hidden == False, sqlite_where=hidden == False),
+    )
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
@@ -49,13 +106,90 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    genres = db.relationship('Genre', secondary=artist_genres)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_Artist_state_city_name', 'state', 'city', 'name', 'id'),
+    )
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+class Show(db.Model):
+    __tablename__ = 'Show'
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False, index=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    # timestamptz on postgres; always written and compared in UTC
+    start_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    end_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    venue = db.relationship('Venue', backref=db.backref('shows', lazy='dynamic'))
+    artist = db.relationship('Artist', backref=db.backref('shows', lazy='dynamic'))
+
+    # /shows pages walk this index in either direction from now()
+    __table_args__ = (
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
+
+    @classmethod
+    def artist_conflict(cls, artist_id, start_time, end_time):
+        '''Return the show of artist_id overlapping [start_time, end_time), or None.
+
+        An artist's shows never overlap each other, so the only candidate
+        is the last one starting before end_time: any earlier show ends
+        before that one starts. Finding it is one seek on
+        ix_Show_artist_id_start_time, however long the artist's history.
+        '''
+        previous = cls.query.filter(cls.artist_id == artist_id, cls.start_time < end_time) \
+            .order_by(cls.start_time.desc()).first()
+        if previous is not None and as_utc(previous.end_time) > start_time:
+            return previous
+        return None
+
+# postgres enforces the same rule itself, which also catches two submissions racing
+db.event.listen(Show.__table__, 'after_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS btree_gist; '
+    'ALTER TABLE "Show" ADD CONSTRAINT "Show_artist_no_overlap" '
+    'EXCLUDE USING gist (artist_id WITH =, tstzrange(start_time, end_time) WITH &&)'
+).execute_if(dialect='postgresql'))
+
+class ShowStat(db.Model):
+    '''Booking rollups for /stats, kept in step with Show by bump_show_stats().
+
+    One row per (dimension, bucket): 'month' -> 'YYYY-MM' (UTC),
+    'city' -> 'City, ST' of the venue, 'genre' -> a genre of the artist,
+    'venue' -> the venue id. A hidden venue loses its 'venue' row at once;
+    its shows leave the other dimensions as they are purged.
+    '''
+    __tablename__ = 'ShowStat'
+
+    dimension = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.String(250), primary_key=True)
+    shows = db.Column(db.Integer, nullable=False, default=0)
+
+    # busiest venues/cities read the top of this index
+    __table_args__ = (
+        db.Index('ix_ShowStat_dimension_shows', 'dimension', 'shows'),
+    )
+
+class BatchJob(db.Model):
+    '''Progress of a background job run by a BatchJobWorker, e.g. 'venue:12' for a venue purge.'''
+    __tablename__ = 'BatchJob'
+
+    key = db.Column(db.String(100), primary_key=True)
+    state = db.Column(db.String(10), nullable=False)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+# TODO complete all model relationships and properties, as a database migration.
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -71,6 +205,372 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def utcnow():
+  return datetime.now(timezone.utc)
+
+def as_utc(value):
+  # sqlite hands back naive datetimes; everything is stored as UTC
+  if value.tzinfo is None:
+    return value.replace(tzinfo=timezone.utc)
+  return value.astimezone(timezone.utc)
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+class KeysetPage(object):
+  '''One page of query ordered by columns, fetched as a template iterates it.
+
+  after is the key of the last row of the previous page. Rows are found
+  by seeking the (columns) index past that key, so every page costs the
+  same regardless of how deep into the listing it is. They are read with
+  yield_per and handed to convert(rows) -> dicts batch_size at a time, so
+  a streamed page holds one batch in memory however long it is.
+  last_key, and so next_url for the pager, is known once iteration has
+  finished; cursor(last_key) is the ?<param>= value of the next page.
+  '''
+
+  def __init__(self, query, columns, after=None, descending=False, per_page=30, convert=None, cursor=None,
+               param='after', batch_size=200):
+    key = db.tuple_(*columns)
+    if after is not None:
+      query = query.filter(key < after if descending else key > after)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    self.query = query.order_by(*order).limit(per_page + 1)
+    self.columns = columns
+    self.per_page = per_page
+    self.convert = convert or (lambda rows: rows)
+    self.cursor = cursor or (lambda key: key[-1])
+    self.param = param
+    self.batch_size = batch_size
+    self.started = False
+    self.last_key = None
+
+  def __iter__(self):
+    self.started = True
+    batch = []
+    count = 0
+    for row in self.query.yield_per(self.batch_size):
+      if count == self.per_page:
+        # the extra row only says there is a next page
+        self.last_key = tuple(getattr(last, column.key) for column in self.columns)
+        break
+      count += 1
+      last = row
+      batch.append(row)
+      if len(batch) == self.batch_size:
+        for item in self.convert(batch):
+          yield item
+        batch = []
+    for item in self.convert(batch):
+      yield item
+
+  @property
+  def next_url(self):
+    return next_page_url(self.cursor(self.last_key), self.param) if self.last_key else None
+
+def next_page_url(cursor, param='after'):
+  # same endpoint and filters, continuing after cursor
+  args = dict(request.view_args, **request.args.to_dict())
+  args[param] = cursor
+  return url_for(request.endpoint, **args)
+
+def page_after_id(param='after'):
+  after = request.args.get(param)
+  if after is None:
+    return None
+  if not after.isdigit():
+    abort(400)
+  return (int(after),)
+
+def page_after_key(model, columns, param='after'):
+  # the full sort key of the row whose id is the ?after= cursor
+  after = page_after_id(param)
+  if after is None:
+    return None
+  key = db.session.query(*columns).filter(model.id == after[0]).first()
+  if key is None:
+    abort(400)
+  return tuple(key)
+
+def page_size(default):
+  # ?per_page= lets a client ask for long pages; streaming keeps those cheap
+  per_page = request.args.get('per_page', default, type=int)
+  return min(max(per_page, 1), app.config['LISTING_MAX_PER_PAGE'])
+
+def stream_page(template, **context):
+  '''Render template a piece at a time as the response is sent.
+
+  Everything before the first KeysetPage in the context is iterated,
+  i.e. the layout, goes out as soon as it is rendered; listing rows are
+  fetched while the body streams and sent in packets of about 8 KB.
+  '''
+  pages = [value for value in context.values() if isinstance(value, KeysetPage)]
+  # the session is saved before the body streams, so take the flashed
+  # messages out of it now; the layout's get_flashed_messages() reuses them
+  get_flashed_messages(with_categories=True)
+  app.update_template_context(context)
+  chunks = app.jinja_env.get_template(template).generate(context)
+  return Response(stream_with_context(packets(chunks, lambda: any(page.started for page in pages))),
+    mimetype='text/html')
+
+def packets(chunks, listing_started, size=8192):
+  # jinja yields a chunk per template fragment, i.e. several per listed row
+  pending = []
+  pending_size = 0
+  for chunk in chunks:
+    pending.append(chunk)
+    pending_size += len(chunk)
+    if pending_size >= size or not listing_started():
+      yield ''.join(pending)
+      pending = []
+      pending_size = 0
+  if pending:
+    yield ''.join(pending)
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+def cached_page(entity, entity_id):
+  # flashed messages belong to a single visitor, so those pages bypass the cache
+  if '_flashes' in session:
+    return None
+  return page_cache.get(entity, entity_id)
+
+def render_cached_page(entity, entity_id, version, upcoming_shows, template, **context):
+  '''Render a page and cache it; version is page_cache.version() as read before querying its data.'''
+  cacheable = '_flashes' not in session
+  body = render_template(template, **context)
+  if cacheable:
+    # the page is stale once its next upcoming show moves into past shows
+    starts = [dateutil.parser.parse(show['start_time']).timestamp() for show in upcoming_shows]
+    page_cache.set(entity, entity_id, body, version, min(starts) if starts else None)
+  return body
+
+def visible_venue_or_404(venue_id):
+  return Venue.query.filter(Venue.id == venue_id, Venue.hidden == False).first_or_404()
+
+def bump_show_pages(venue_id, artist_id):
+  page_cache.bump('venue', venue_id)
+  page_cache.bump('artist', artist_id)
+
+#----------------------------------------------------------------------------#
+# Booking statistics.
+#----------------------------------------------------------------------------#
+
+def city_bucket(city, state):
+  return '{}, {}'.format(city, state)
+
+def artist_genre_names(artist_ids):
+  names = {}
+  if artist_ids:
+    for artist_id, genre in db.session.query(artist_genres.c.artist_id, artist_genres.c.genre) \
+        .filter(artist_genres.c.artist_id.in_(artist_ids)):
+      names.setdefault(artist_id, []).append(genre)
+  return names
+
+def show_stat_counts(shows, genres, sign=1):
+  '''Count (dimension, bucket) deltas for shows given as
+  (venue_id, city, state, start_time, artist_id) rows; genres maps artist id -> genre names.'''
+  counts = Counter()
+  for venue_id, city, state, start_time, artist_id in shows:
+    counts['month', as_utc(start_time).strftime('%Y-%m')] += sign
+    counts['city', city_bucket(city, state)] += sign
+    if venue_id is not None:
+      counts['venue', str(venue_id)] += sign
+    for genre in genres.get(artist_id, ()):
+      counts['genre', genre] += sign
+  return counts
+
+def upsert_dialect():
+  # INSERT ... ON CONFLICT DO UPDATE, where the database and SQLAlchemy support it
+  name = db.session.get_bind().dialect.name
+  try:
+    if name == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+      return insert
+    if name == 'sqlite':
+      from sqlalchemy.dialects.sqlite import insert
+      return insert
+  except ImportError:
+    pass
+  return None
+
+def bump_show_stats(counts):
+  '''Apply {(dimension, bucket): delta} to ShowStat in the current transaction.
+
+  Buckets are incremented in place (shows = shows + delta), so concurrent
+  bookings never overwrite each other's counts. All the increments are one
+  executemany INSERT ... ON CONFLICT DO UPDATE, which creates missing
+  buckets, and all the decrements one executemany UPDATE, however many
+  buckets a batch of shows touches.
+  '''
+  table = ShowStat.__table__
+  insert = upsert_dialect()
+  if insert is None:
+    bump_show_stats_by_row(counts)
+    return
+  increments = [{'dimension': dimension, 'bucket': bucket, 'shows': delta}
+    for (dimension, bucket), delta in counts.items() if delta > 0]
+  decrements = [{'_dimension': dimension, '_bucket': bucket, '_delta': delta}
+    for (dimension, bucket), delta in counts.items() if delta < 0]
+  if increments:
+    statement = insert(table)
+    db.session.execute(statement.on_conflict_do_update(
+      index_elements=[table.c.dimension, table.c.bucket],
+      set_={'shows': table.c.shows + statement.excluded.shows}), increments)
+  if decrements:
+    db.session.execute(table.update()
+      .where(table.c.dimension == bindparam('_dimension'))
+      .where(table.c.bucket == bindparam('_bucket'))
+      .values(shows=table.c.shows + bindparam('_delta')), decrements)
+
+def bump_show_stats_by_row(counts):
+  # without upserts: an UPDATE per bucket, inserting it in a savepoint if missing
+  for (dimension, bucket), delta in counts.items():
+    if not delta:
+      continue
+    match = ShowStat.query.filter(ShowStat.dimension == dimension, ShowStat.bucket == bucket)
+    if match.update({'shows': ShowStat.shows + delta}, synchronize_session=False) or delta < 0:
+      continue
+    try:
+      with db.session.begin_nested():
+        db.session.execute(ShowStat.__table__.insert(), {'dimension': dimension, 'bucket': bucket, 'shows': delta})
+    except IntegrityError:
+      match.update({'shows': ShowStat.shows + delta}, synchronize_session=False)
+
+def move_show_stats(dimension, old_buckets, new_buckets, shows):
+  # an edited venue city or artist genre list re-attributes the entity's shows
+  counts = Counter()
+  for bucket in set(old_buckets) - set(new_buckets):
+    counts[dimension, bucket] -= shows
+  for bucket in set(new_buckets) - set(old_buckets):
+    counts[dimension, bucket] += shows
+  bump_show_stats(counts)
+
+def venue_stats_moved(previous, form):
+  if (previous.city, previous.state) == (form.city.data, form.state.data):
+    return
+  shows = db.session.query(ShowStat.shows) \
+    .filter(ShowStat.dimension == 'venue', ShowStat.bucket == str(previous.id)).scalar() or 0
+  move_show_stats('city', [city_bucket(previous.city, previous.state)],
+    [city_bucket(form.city.data, form.state.data)], shows)
+
+def artist_stats_moved(previous, form):
+  old_genres = [genre.name for genre in previous.genres]
+  if set(old_genres) == set(form.genres.data):
+    return
+  # counting the artist's shows only when they move between genres
+  shows = Show.query.filter(Show.artist_id == previous.id).count()
+  move_show_stats('genre', old_genres, form.genres.data, shows)
+
+def rebuild_show_stats():
+  '''Recount every rollup from Show in one transaction; returns the number of buckets.'''
+  ShowStat.query.delete(synchronize_session=False)
+  genres = {}
+  for artist_id, genre in db.session.query(artist_genres.c.artist_id, artist_genres.c.genre):
+    genres.setdefault(artist_id, []).append(genre)
+  rows = db.session.query(Show.venue_id, Venue.hidden, Venue.city, Venue.state, Show.start_time, Show.artist_id) \
+    .join(Venue, Venue.id == Show.venue_id).yield_per(10000)
+  # hidden venues keep their shows in the other dimensions until purged, like the incremental path
+  shows = ((None if hidden else venue_id, city, state, start_time, artist_id)
+    for venue_id, hidden, city, state, start_time, artist_id in rows)
+  counts = show_stat_counts(shows, genres)
+  if counts:
+    db.session.execute(ShowStat.__table__.insert(), [
+      {'dimension': dimension, 'bucket': bucket, 'shows': shows}
+      for (dimension, bucket), shows in counts.items() if shows > 0])
+  db.session.commit()
+  return len(counts)
+
+#----------------------------------------------------------------------------#
+# Optimistic concurrency.
+#----------------------------------------------------------------------------#
+
+def update_versioned(model, link_table, key, entity_id, form, on_update=None):
+  '''Apply a validated edit form without locking the row.
+
+  One UPDATE ... WHERE id = :id AND version = :version writes the fields
+  and bumps the version, so of several editors who loaded the same
+  version only the first to submit matches. Returns False for everyone
+  else (or if the row is gone); nothing is written in that case.
+
+  on_update(previous, form), if given, runs in the same transaction once
+  the UPDATE has matched; previous is the row as of the replaced version.
+  This costs one primary-key read of the row (and its genres) before the
+  UPDATE, which the /stats rollups need to know what the edit moved;
+  without on_update the edit writes without reading first.
+  '''
+  previous = None
+  if on_update is not None:
+    # read at the submitted version: if the UPDATE matches, these are the values it replaced
+    previous = model.query.filter(model.id == entity_id, model.version == form.version.data).first()
+    if previous is None:
+      db.session.rollback()
+      return False
+  fields = {name: value for name, value in form.data.items() if name not in ('genres', 'version', 'csrf_token')}
+  fields['version'] = model.version + 1
+  updated = model.query.filter(model.id == entity_id, model.version == form.version.data) \
+    .update(fields, synchronize_session=False)
+  if updated != 1:
+    db.session.rollback()
+    return False
+  if on_update is not None:
+    # before the link rows are replaced, so previous.genres still loads the old ones
+    on_update(previous, form)
+  db.session.execute(link_table.delete().where(link_table.c[key] == entity_id))
+  db.session.execute(link_table.insert(), [{'genre': genre, key: entity_id} for genre in form.genres.data])
+  db.session.commit()
+  return True
+
+def edit_conflict(entity, model, entity_id):
+  current = model.query.get_or_404(entity_id)
+  return render_template('pages/edit_conflict.html', entity=entity, current=current), 409
+
+#----------------------------------------------------------------------------#
+# Background deletes.
+#----------------------------------------------------------------------------#
+
+purge_worker = BatchJobWorker(app, db, BatchJob, max_retries=app.config['PURGE_MAX_RETRIES'],
+                              stale_after=app.config['PURGE_STALE_SECONDS'])
+
+def purge_job_key(venue_id):
+  return 'venue:{}'.format(venue_id)
+
+def pending_purges():
+  # hidden venues whose purge didn't finish, e.g. because the process running it exited
+  return [(purge_job_key(venue_id), functools.partial(purge_venue_batch, venue_id))
+          for venue_id, in Venue.query.filter(Venue.hidden == True).with_entities(Venue.id).all()]
+
+@app.before_request
+def resume_purges():
+  # the first request of each worker process picks up the purges left unfinished
+  purge_worker.resume(pending_purges)
+
+def purge_venue_batch(venue_id):
+  '''Delete the next PURGE_BATCH_SIZE shows of a hidden venue, then the venue.
+
+  Returns the number of rows deleted; 0 once nothing is left.
+  '''
+  shows = db.session.query(Show.id, Venue.city, Venue.state, Show.start_time, Show.artist_id) \
+    .join(Venue, Venue.id == Show.venue_id) \
+    .filter(Show.venue_id == venue_id).limit(app.config['PURGE_BATCH_SIZE']).all()
+  if shows:
+    # the venue's own rollup row went when it was hidden; count the rest down with the batch
+    bump_show_stats(show_stat_counts([(None, city, state, start_time, artist_id)
+      for _, city, state, start_time, artist_id in shows],
+      artist_genre_names({show.artist_id for show in shows}), sign=-1))
+    deleted = Show.query.filter(Show.id.in_([show.id for show in shows])).delete(synchronize_session=False)
+    if deleted != len(shows):
+      # another purge got some of these rows first; their counts are already gone
+      raise RuntimeError('venue {}: shows deleted concurrently, retrying batch'.format(venue_id))
+  else:
+    db.session.execute(venue_genres.delete().where(venue_genres.c.venue_id == venue_id))
+    deleted = Venue.query.filter(Venue.id == venue_id, Venue.hidden == True).delete(synchronize_session=False)
+  db.session.commit()
+  return deleted
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -85,30 +585,34 @@ def index():
 
 @app.route('/venues')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "city": "San Francisco",
-    "state": "CA",
-    "venues": [{
-      "id": 1,
-      "name": "The Musical Hop",
-      "num_upcoming_shows": 0,
-    }, {
-      "id": 3,
-      "name": "Park Square Live Music & Coffee",
-      "num_upcoming_shows": 1,
-    }]
-  }, {
-    "city": "New York",
-    "state": "NY",
-    "venues": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }]
-  return render_template('pages/venues.html', areas=data);
+  # ?genre= narrows to one genre, ?after= is the last venue id of the previous page
+  genre = request.args.get('genre')
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state).filter(Venue.hidden == False)
+  if genre:
+    # listed in venue id order, which the (genre, venue_id) key of venue_genres already has
+    query = query.join(venue_genres, venue_genres.c.venue_id == Venue.id).filter(venue_genres.c.genre == genre) \
+      .add_columns(venue_genres.c.venue_id)
+    columns = [venue_genres.c.venue_id]
+    after = page_after_id()
+  else:
+    # listed by area and name; the cursor stays a venue id and its key is looked up here
+    columns = [Venue.state, Venue.city, Venue.name, Venue.id]
+    after = page_after_key(Venue, columns)
+
+  def with_upcoming(rows):
+    upcoming = dict(db.session.query(Show.venue_id, db.func.count(Show.id))
+      .filter(Show.venue_id.in_([row.id for row in rows]), Show.start_time >= utcnow())
+      .group_by(Show.venue_id).all()) if rows else {}
+    return [{
+      "id": row.id,
+      "name": row.name,
+      "city": row.city,
+      "state": row.state,
+      "num_upcoming_shows": upcoming.get(row.id, 0),
+    } for row in rows]
+
+  page = KeysetPage(query, columns, after, per_page=page_size(app.config['LISTING_PER_PAGE']), convert=with_upcoming)
+  return stream_page('pages/venues.html', venues=page, genre=genre)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -128,6 +632,10 @@ def search_venues():
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
+  page = cached_page('venue', venue_id)
+  if page is not None:
+    return page
+  version = page_cache.version('venue', venue_id)
   # TODO: replace with real venue data from the venues table, using venue_id
   data1={
     "id": 1,
@@ -207,7 +715,7 @@ def show_venue(venue_id):
     "upcoming_shows_count": 1,
   }
   data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-  return render_template('pages/show_venue.html', venue=data)
+  return render_cached_page('venue', venue_id, version, data['upcoming_shows'], 'pages/show_venue.html', venue=data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -229,31 +737,112 @@ def create_venue_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-  # TODO: Complete this endpoint for taking a venue_id, and using
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  # Hides the venue with one UPDATE and returns; its shows (possibly tens of
+  # thousands) and then the venue row are deleted in batches by purge_worker.
+  try:
+    hidden = Venue.query.filter(Venue.id == venue_id, Venue.hidden == False) \
+      .update({'hidden': True, 'version': Venue.version + 1}, synchronize_session=False)
+    if hidden:
+      ShowStat.query.filter(ShowStat.dimension == 'venue', ShowStat.bucket == str(venue_id)) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+  except SQLAlchemyError:
+    db.session.rollback()
+    abort(500)
+  if not hidden:
+    abort(404)
+  page_cache.bump('venue', venue_id)
+  bump_areas()
+  purge_worker.submit(purge_job_key(venue_id), functools.partial(purge_venue_batch, venue_id))
+  return jsonify({
+    'success': True,
+    'venue_id': venue_id,
+    'status_url': url_for('delete_venue_status', venue_id=venue_id),
+  }), 202
 
-  # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-  # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+@app.route('/venues/<int:venue_id>/delete-status')
+def delete_venue_status(venue_id):
+  status = purge_worker.status(purge_job_key(venue_id))
+  if status is None:
+    abort(404)
+  return jsonify(status)
+
+#  Areas
+#  ----------------------------------------------------------------
+
+def area_counts():
+  '''Venue and artist counts per state and city, as a list of states.
+
+  Both GROUP BYs walk the (state, city, name) indexes. The result is kept
+  in page_cache for AREA_COUNTS_TTL seconds; edits that can move a venue
+  or artist bump it sooner.
+  '''
+  cached = page_cache.get('areas', None)
+  if cached is not None:
+    return json.loads(cached)
+  version = page_cache.version('areas', None)
+  cities = {}
+  for kind, model, query in (
+      ('venues', Venue, Venue.query.filter(Venue.hidden == False)),
+      ('artists', Artist, Artist.query)):
+    # places without a state or city have no area page to link to
+    query = query.filter(model.state != None, model.state != '', model.city != None, model.city != '')
+    for state, city, count in query.with_entities(model.state, model.city, db.func.count(model.id)) \
+        .group_by(model.state, model.city):
+      area = cities.setdefault((state, city), {"city": city, "venues": 0, "artists": 0})
+      area[kind] = count
+  states = []
+  for (state, city), area in sorted(cities.items()):
+    if not states or states[-1]['state'] != state:
+      states.append({"state": state, "venues": 0, "artists": 0, "cities": []})
+    states[-1]['cities'].append(area)
+    states[-1]['venues'] += area['venues']
+    states[-1]['artists'] += area['artists']
+  page_cache.set('areas', None, json.dumps(states), version, time.time() + app.config['AREA_COUNTS_TTL'])
+  return states
+
+def bump_areas():
+  page_cache.bump('areas', None)
+
+@app.route('/areas')
+def areas():
+  return render_template('pages/areas.html', states=area_counts())
+
+@app.route('/areas/<state>/<city>')
+def area(state, city):
+  # venues and artists of one city, each paged on its own cursor (?venues_after=, ?artists_after=)
+  per_page = page_size(app.config['LISTING_PER_PAGE'])
+  pages = {}
+  for kind, model, query in (
+      ('venues', Venue, Venue.query.filter(Venue.hidden == False)),
+      ('artists', Artist, Artist.query)):
+    param = kind + '_after'
+    query = query.with_entities(model.id, model.name).filter(model.state == state, model.city == city)
+    pages[kind] = KeysetPage(query, [model.name, model.id], page_after_key(model, [model.name, model.id], param),
+                             per_page=per_page, param=param)
+  return stream_page('pages/area.html', state=state, city=city, **pages)
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[{
-    "id": 4,
-    "name": "Guns N Petals",
-  }, {
-    "id": 5,
-    "name": "Matt Quevedo",
-  }, {
-    "id": 6,
-    "name": "The Wild Sax Band",
-  }]
-  return render_template('pages/artists.html', artists=data)
+  # ?genre= narrows to one genre, ?after= is the last artist id of the previous page
+  genre = request.args.get('genre')
+  query = db.session.query(Artist.id, Artist.name)
+  columns = [Artist.id]
+  if genre:
+    # seek and order on the link table's (genre, artist_id) key, so a page is one range scan
+    query = query.join(artist_genres, artist_genres.c.artist_id == Artist.id).filter(artist_genres.c.genre == genre) \
+      .add_columns(artist_genres.c.artist_id)
+    columns = [artist_genres.c.artist_id]
+  page = KeysetPage(query, columns, page_after_id(), per_page=page_size(app.config['LISTING_PER_PAGE']),
+                    convert=lambda rows: [{
+                      "id": row.id,
+                      "name": row.name,
+                    } for row in rows])
+  return stream_page('pages/artists.html', artists=page, genre=genre)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -273,6 +862,10 @@ def search_artists():
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
+  page = cached_page('artist', artist_id)
+  if page is not None:
+    return page
+  version = page_cache.version('artist', artist_id)
   # TODO: replace with real venue data from the venues table, using venue_id
   data1={
     "id": 4,
@@ -346,60 +939,60 @@ def show_artist(artist_id):
     "upcoming_shows_count": 3,
   }
   data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
-  return render_template('pages/show_artist.html', artist=data)
+  return render_cached_page('artist', artist_id, version, data['upcoming_shows'], 'pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  form = ArtistForm()
-  artist={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80"
-  }
-  # TODO: populate form with fields from artist with ID <artist_id>
+  artist = Artist.query.get_or_404(artist_id)
+  form = EditArtistForm(obj=artist)
+  form.genres.data = [genre.name for genre in artist.genres]
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # TODO: take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
-
+  form = EditArtistForm()
+  if not form.validate_on_submit():
+    flash('An error occurred. Artist could not be updated.')
+    return render_template('forms/edit_artist.html', form=form, artist=Artist.query.get_or_404(artist_id))
+  try:
+    updated = update_versioned(Artist, artist_genres, 'artist_id', artist_id, form, artist_stats_moved)
+  except SQLAlchemyError:
+    db.session.rollback()
+    flash('An error occurred. Artist ' + form.name.data + ' could not be updated.')
+    return render_template('forms/edit_artist.html', form=form, artist=Artist.query.get_or_404(artist_id))
+  if not updated:
+    return edit_conflict('artist', Artist, artist_id)
+  page_cache.bump('artist', artist_id)
+  bump_areas()
+  flash('Artist ' + form.name.data + ' was successfully updated!')
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  form = VenueForm()
-  venue={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60"
-  }
-  # TODO: populate form with values from venue with ID <venue_id>
+  venue = visible_venue_or_404(venue_id)
+  form = EditVenueForm(obj=venue)
+  form.genres.data = [genre.name for genre in venue.genres]
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # TODO: take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
+  form = EditVenueForm()
+  if not form.validate_on_submit():
+    flash('An error occurred. Venue could not be updated.')
+    return render_template('forms/edit_venue.html', form=form, venue=visible_venue_or_404(venue_id))
+  try:
+    updated = update_versioned(Venue, venue_genres, 'venue_id', venue_id, form, venue_stats_moved)
+  except SQLAlchemyError:
+    db.session.rollback()
+    flash('An error occurred. Venue ' + form.name.data + ' could not be updated.')
+    return render_template('forms/edit_venue.html', form=form, venue=visible_venue_or_404(venue_id))
+  if not updated:
+    return edit_conflict('venue', Venue, venue_id)
+  page_cache.bump('venue', venue_id)
+  bump_areas()
+  flash('Venue ' + form.name.data + ' was successfully updated!')
   return redirect(url_for('show_venue', venue_id=venue_id))
 
 #  Create Artist
@@ -428,46 +1021,50 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "venue_id": 1,
-    "venue_name": "The Musical Hop",
-    "artist_id": 4,
-    "artist_name": "Guns N Petals",
-    "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "start_time": "2019-05-21T21:30:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 5,
-    "artist_name": "Matt Quevedo",
-    "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "start_time": "2019-06-15T23:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-01T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-08T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-15T20:00:00.000Z"
-  }]
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, one page at a time.
+  # ?when=upcoming|past|all, optional ?from=&to= dates, ?after= cursor from the previous page
+  when = request.args.get('when', 'upcoming')
+  if when not in ('upcoming', 'past', 'all'):
+    abort(400)
+  try:
+    date_from = request.args.get('from') and as_utc(dateutil.parser.parse(request.args['from']))
+    date_to = request.args.get('to') and as_utc(dateutil.parser.parse(request.args['to']))
+    after = request.args.get('after')
+    if after:
+      after_time, after_id = after.rsplit('_', 1)
+      after = (as_utc(dateutil.parser.parse(after_time)), int(after_id))
+  except (ValueError, OverflowError):
+    # OverflowError: dateutil on numbers too large for a date
+    abort(400)
+
+  query = db.session.query(
+    Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+    Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id) \
+    .filter(Venue.hidden == False)
+  now = utcnow()
+  if when == 'upcoming':
+    query = query.filter(Show.start_time >= now)
+  elif when == 'past':
+    query = query.filter(Show.start_time < now)
+  if date_from:
+    query = query.filter(Show.start_time >= date_from)
+  if date_to:
+    query = query.filter(Show.start_time < date_to)
+
+  # past shows read newest first, everything else soonest first
+  page = KeysetPage(query, [Show.start_time, Show.id], after, descending=(when == 'past'),
+                    per_page=page_size(app.config['SHOWS_PER_PAGE']),
+                    convert=lambda rows: [{
+                      "venue_id": row.venue_id,
+                      "venue_name": row.venue_name,
+                      "artist_id": row.artist_id,
+                      "artist_name": row.artist_name,
+                      "artist_image_link": row.artist_image_link,
+                      "start_time": as_utc(row.start_time).isoformat(),
+                    } for row in rows],
+                    cursor=lambda key: '{}_{}'.format(as_utc(key[0]).isoformat(), key[1]))
+  return stream_page('pages/shows.html', shows=page, when=when)
 
 @app.route('/shows/create')
 def create_shows():
@@ -478,15 +1075,107 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
+  form = ShowForm()
+  if not form.validate_on_submit():
+    flash('An error occurred. Show could not be listed.')
+    return render_template('forms/new_show.html', form=form)
+  try:
+    artist_id = int(form.artist_id.data)
+    venue_id = int(form.venue_id.data)
+  except ValueError:
+    artist_id = venue_id = None
+  artist = artist_id and Artist.query.get(artist_id)
+  venue = venue_id and Venue.query.filter(Venue.id == venue_id, Venue.hidden == False).first()
+  if not artist or not venue:
+    flash('An error occurred. Show could not be listed: unknown artist or venue.')
+    return render_template('forms/new_show.html', form=form)
+
+  start_time = as_utc(form.start_time.data)
+  end_time = start_time + timedelta(minutes=form.duration.data)
+  conflict = Show.artist_conflict(artist_id, start_time, end_time)
+  if conflict is not None:
+    flash('Show could not be listed: {} is already playing {} from {} to {}.'.format(
+      artist.name, conflict.venue.name,
+      format_datetime(as_utc(conflict.start_time).isoformat()),
+      format_datetime(as_utc(conflict.end_time).isoformat())))
+    return render_template('forms/new_show.html', form=form)
+
+  try:
+    db.session.add(Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time, end_time=end_time))
+    bump_show_stats(show_stat_counts([(venue_id, venue.city, venue.state, start_time, artist_id)],
+      {artist_id: [genre.name for genre in artist.genres]}))
+    db.session.commit()
+  except IntegrityError:
+    # lost a race with another booking for the same artist (postgres exclusion constraint)
+    db.session.rollback()
+    flash('Show could not be listed: {} was just booked for an overlapping time.'.format(artist.name))
+    return render_template('forms/new_show.html', form=form)
+  except SQLAlchemyError:
+    db.session.rollback()
+    flash('An error occurred. Show could not be listed.')
+    return render_template('forms/new_show.html', form=form)
+  bump_show_pages(venue_id, artist_id)
 
   # on successful db insert, flash success
   flash('Show was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#  Stats
+#  ----------------------------------------------------------------
+
+@app.route('/stats')
+def stats():
+  # reads the rollups only: one row per month, city, genre and top venue
+  def buckets(dimension, limit=None):
+    query = db.session.query(ShowStat.bucket, ShowStat.shows) \
+      .filter(ShowStat.dimension == dimension, ShowStat.shows > 0)
+    if dimension == 'month':
+      return query.order_by(ShowStat.bucket).all()
+    return query.order_by(ShowStat.shows.desc(), ShowStat.bucket).limit(limit).all()
+
+  top = buckets('venue', app.config['STATS_TOP_VENUES'])
+  names = dict(db.session.query(Venue.id, Venue.name)
+    .filter(Venue.id.in_([int(bucket) for bucket, _ in top]))) if top else {}
+  busiest = [{"id": int(bucket), "name": names.get(int(bucket)), "shows": shows} for bucket, shows in top]
+  return render_template('pages/stats.html', months=buckets('month'), cities=buckets('city'),
+    genres=buckets('genre'), venues=busiest)
+
+#  Images
+#  ----------------------------------------------------------------
+
+@app.route('/img/<any(venue, artist):entity>/<int:entity_id>')
+def thumbnail(entity, entity_id):
+  if entity == 'venue':
+    image_link = visible_venue_or_404(entity_id).image_link
+  else:
+    image_link = Artist.query.get_or_404(entity_id).image_link
+  if not image_link:
+    abort(404)
+  original = local_original(image_link, app.static_folder, app.config['IMAGE_ORIGINALS_DIR'])
+  if original is None or Image is None:
+    # not fetched yet (or no Pillow): let the browser load the full image
+    return redirect(image_link)
+
+  width = snap_width(request.args.get('w', max(app.config['THUMBNAIL_WIDTHS']), type=int),
+    app.config['THUMBNAIL_WIDTHS'])
+  image_format = 'webp' if request.accept_mimetypes['image/webp'] else 'jpeg'
+  key = thumbnail_cache.key(original, width, image_format)
+  data = thumbnail_cache.get(key)
+  if data is None:
+    data = render_thumbnail(original, width, image_format)
+    thumbnail_cache.put(key, data)
+
+  response = Response(data, mimetype=THUMBNAIL_FORMATS[image_format][1])
+  response.set_etag(key)
+  response.cache_control.public = True
+  response.cache_control.max_age = app.config['THUMBNAIL_MAX_AGE']
+  response.vary.add('Accept')
+  return response.make_conditional(request)
+
+@app.route('/metrics/page-cache')
+def page_cache_metrics():
+  return jsonify(page_cache.stats())
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -496,16 +1185,21 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
+log_handler = None
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    log_handler = setup_logging(app)
     app.logger.info('errors')
 
+@app.route('/metrics/logging')
+def logging_metrics():
+  if log_handler is None:
+    return jsonify({'enabled': False})
+  return jsonify({
+    'enabled': True,
+    'queued': log_handler.queue.qsize(),
+    'dropped': log_handler.dropped,
+  })
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
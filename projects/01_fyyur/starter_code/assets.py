@@ -0,0 +1,138 @@
+#----------------------------------------------------------------------------#
+# Fingerprinted static assets.
+#
+# `flask fyyur build-assets` copies static/ into static/dist/ under
+# content-hashed names (css/main.css -> css/main.3f2a9c1b0d4e.css) with
+# .gz/.br siblings, and writes a manifest. Templates keep calling
+# url_for('static', filename=...); once a manifest exists that resolves to
+# /assets/<hashed name>, served precompressed with a far-future immutable
+# Cache-Control since the name changes whenever the content does.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory, url_for as flask_url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# already compressed formats gain nothing from gzip/brotli
+INCOMPRESSIBLE = ('.jpg', '.jpeg', '.png', '.gif', '.ico', '.woff', '.woff2', '.map')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def hashed_name(name, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def rewrite_css_urls(name, content, manifest):
+    # point url(...) references at their hashed names, keeping ?query and #fragment
+    base = posixpath.dirname(name)
+
+    def replace(match):
+        quote, target = match.groups()
+        if target.startswith(('data:', 'http:', 'https:', '//', '/')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', target).groups()
+        resolved = posixpath.normpath(posixpath.join(base, path))
+        if resolved not in manifest:
+            return match.group(0)
+        relative = posixpath.relpath(manifest[resolved], base or '.')
+        return 'url({0}{1}{2}{0})'.format(quote, relative, suffix)
+
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def write_compressed(path, content):
+    if path.endswith(INCOMPRESSIBLE):
+        return
+    variants = [('.gz', gzip.compress(content, 9))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(content) * 0.9:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def build_assets(static_dir, dist_dir):
+    '''Write fingerprinted, precompressed copies of static_dir into dist_dir.
+
+    Returns the manifest: logical name -> hashed name, both relative to
+    their directory. CSS is processed last so its url() references can
+    be rewritten to the hashed fonts and images.
+    '''
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        # never fingerprint a previous build
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != os.path.abspath(dist_dir)]
+        for filename in files:
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(root, filename)
+            sources.append(os.path.relpath(path, static_dir).replace(os.sep, '/'))
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            content = f.read()
+        if name.endswith('.css'):
+            content = rewrite_css_urls(name, content, manifest)
+        manifest[name] = hashed_name(name, content)
+        target = os.path.join(dist_dir, manifest[name])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+        write_compressed(target, content)
+
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def init_assets(app):
+    '''Serve built assets and make template url_for('static', ...) emit their hashed names.'''
+    dist_dir = os.path.join(app.static_folder, 'dist')
+    manifest_path = os.path.join(dist_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    def url_for(endpoint, **values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+            endpoint = 'asset'
+        return flask_url_for(endpoint, **values)
+
+    @app.route('/assets/<path:filename>')
+    def asset(filename):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            # a q=0 entry refuses the encoding
+            if accepted[encoding] > 0 and os.path.isfile(os.path.join(dist_dir, filename + suffix)):
+                response = send_from_directory(dist_dir, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(dist_dir, filename, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.jinja_env.globals['url_for'] = url_for
+    return manifest
@@ -0,0 +1,131 @@
+#----------------------------------------------------------------------------#
+# Versioned page cache.
+#----------------------------------------------------------------------------#
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class PageCache(object):
+    """Bounded LRU cache of rendered pages keyed by (entity, id, version).
+
+    Controllers that change an entity call bump(); the next read of that
+    entity misses because its version moved on, and the stale page is
+    dropped right away instead of waiting to fall off the LRU end.
+
+    With versions_dir, an entity's version is a small file in it that
+    bump() replaces, so a bump in any worker process on the machine makes
+    every worker's copy stale; reading it is a stat(). Without it versions
+    live in this process only. Either way no page is kept longer than
+    max_age seconds, which bounds staleness across machines.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=32 * 1024 * 1024, versions_dir=None, max_age=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.versions_dir = versions_dir
+        self.max_age = max_age
+        if versions_dir:
+            os.makedirs(versions_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _version_path(self, entity, entity_id):
+        return os.path.join(self.versions_dir, '{}-{}'.format(entity, entity_id))
+
+    def version(self, entity, entity_id):
+        """The entity's current version; read it before rendering a page for set()."""
+        if not self.versions_dir:
+            return self._versions.get((entity, entity_id), 0)
+        try:
+            stat = os.stat(self._version_path(entity, entity_id))
+        except FileNotFoundError:
+            return None
+        # bump() replaces the file, so the inode changes even when the
+        # filesystem's mtime is too coarse to
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def bump(self, entity, entity_id):
+        key = (entity, entity_id)
+        if self.versions_dir:
+            with tempfile.NamedTemporaryFile('w', dir=self.versions_dir, delete=False) as f:
+                f.write(str(os.getpid()))
+            os.replace(f.name, self._version_path(entity, entity_id))
+        with self._lock:
+            if not self.versions_dir:
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self._discard(key)
+
+    def get(self, entity, entity_id):
+        key = (entity, entity_id)
+        current = self.version(entity, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires_at, body = entry
+                fresh = expires_at is None or time.time() < expires_at
+                if version == current and fresh:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def set(self, entity, entity_id, body, version, expires_at=None):
+        """Store a page rendered from the entity at version.
+
+        version is what version() returned before rendering began; if the
+        entity was bumped since, the page may be stale and is not stored.
+        expires_at is a unix timestamp after which the page is stale even
+        if the entity was not edited, e.g. when an upcoming show becomes a
+        past show.
+        """
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        if self.max_age is not None:
+            expires_at = min(expires_at or float('inf'), time.time() + self.max_age)
+        key = (entity, entity_id)
+        if self.version(entity, entity_id) != version:
+            return
+        with self._lock:
+            # if a bump lands after the check, get() still never serves
+            # an entry tagged with an older version
+            self._discard(key)
+            self._entries[key] = (version, expires_at, body)
+            self._size += size
+            while (len(self._entries) > self.max_entries
+                   or self._size > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
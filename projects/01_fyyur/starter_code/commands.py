@@ -0,0 +1,387 @@
+#----------------------------------------------------------------------------#
+# CLI commands: flask fyyur <command>
+#----------------------------------------------------------------------------#
+
+import csv
+import json
+import os
+import shutil
+import time
+from bisect import bisect_left
+from datetime import timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+
+from assets import brotli, build_assets
+from images import fetch_original
+from forms import ArtistForm, ShowForm, VenueForm
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur maintenance commands.')
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+def read_rows(path):
+    '''Yield (line number, row dict) from a .csv, .jsonl/.ndjson or .json file.
+
+    CSV and JSON lines are streamed; a .json file holds one array and is
+    read whole, so prefer JSON lines for large imports.
+    '''
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+    elif path.endswith(('.jsonl', '.ndjson')):
+        with open(path) as f:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_no, json.loads(line)
+    elif path.endswith('.json'):
+        with open(path) as f:
+            for line_no, row in enumerate(json.load(f), 1):
+                yield line_no, row
+    else:
+        raise click.BadParameter('expected a .csv, .jsonl, .ndjson or .json file')
+
+
+def to_formdata(row):
+    # CSV cells hold comma separated genres, JSON rows hold a list
+    pairs = []
+    for key, value in row.items():
+        if key == 'genres' and isinstance(value, str):
+            value = [genre.strip() for genre in value.split(',') if genre.strip()]
+        if isinstance(value, list):
+            pairs.extend((key, str(item)) for item in value)
+        elif value is not None:
+            pairs.append((key, str(value)))
+    return MultiDict(pairs)
+
+
+def form_errors(form):
+    return '; '.join('{}: {}'.format(field, ' '.join(errors)) for field, errors in form.errors.items())
+
+
+class ArtistSchedules(object):
+    '''Sorted (start, end) bookings per artist, loaded on first use.
+
+    Lets a show import check each row against both the database and the
+    rows imported before it with a bisect instead of a query per row.
+    '''
+
+    def __init__(self, session, show_model, as_utc):
+        self._session = session
+        self._show = show_model
+        self._as_utc = as_utc
+        self._starts = {}
+        self._ends = {}
+
+    def _load(self, artist_id):
+        if artist_id not in self._starts:
+            rows = self._session.query(self._show.start_time, self._show.end_time) \
+                .filter(self._show.artist_id == artist_id).order_by(self._show.start_time).all()
+            self._starts[artist_id] = [self._as_utc(row.start_time) for row in rows]
+            self._ends[artist_id] = [self._as_utc(row.end_time) for row in rows]
+        return self._starts[artist_id], self._ends[artist_id]
+
+    def conflicts(self, artist_id, start_time, end_time):
+        # bookings never overlap, so only the last one starting before end_time can clash
+        starts, ends = self._load(artist_id)
+        i = bisect_left(starts, end_time) - 1
+        return i >= 0 and ends[i] > start_time
+
+    def add(self, artist_id, start_time, end_time):
+        starts, ends = self._load(artist_id)
+        i = bisect_left(starts, start_time)
+        starts.insert(i, start_time)
+        ends.insert(i, end_time)
+
+    def remove(self, artist_id, start_time):
+        starts, ends = self._load(artist_id)
+        i = bisect_left(starts, start_time)
+        if i < len(starts) and starts[i] == start_time:
+            del starts[i]
+            del ends[i]
+
+
+def name_map(query, model):
+    # name -> id; names shared by several rows map to None and can't be referenced
+    names = {}
+    for row_id, name in query.with_entities(model.id, model.name):
+        names[name] = None if name in names else row_id
+    return names
+
+
+def record_builder(model, key):
+    # validated form -> (record, function giving its genre link rows once it has an id)
+    def build(form):
+        fields = dict(form.data)
+        genres = fields.pop('genres')
+        fields.pop('csrf_token', None)
+        return model(**fields), lambda record: [{'genre': genre, key: record.id} for genre in genres]
+    return build
+
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--rejects', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows. Defaults to <path>.rejected.csv')
+def import_rows(kind, path, batch_size, rejects):
+    '''Import venues, artists or shows from a CSV or JSON lines file.
+
+    Rows are validated with VenueForm, ArtistForm or ShowForm. Shows name
+    their artist and venue with artist_id/venue_id or artist/venue (the
+    name). Rows that fail validation, reference unknown records or double
+    book an artist are written to the rejects file instead of imported.
+    '''
+    from app import db, Venue, Artist, Show, venue_genres, artist_genres, as_utc, bump_show_stats, show_stat_counts
+
+    session = db.session
+    form_class = {'venues': VenueForm, 'artists': ArtistForm, 'shows': ShowForm}[kind]
+    if kind == 'venues':
+        build = record_builder(Venue, 'venue_id')
+        link_table = venue_genres
+    elif kind == 'artists':
+        build = record_builder(Artist, 'artist_id')
+        link_table = artist_genres
+    else:
+        link_table = None
+        artist_ids = {row_id for row_id, in session.query(Artist.id)}
+        venue_ids = {row_id for row_id, in session.query(Venue.id).filter(Venue.hidden == False)}
+        artist_names = name_map(Artist.query, Artist)
+        venue_names = name_map(Venue.query.filter(Venue.hidden == False), Venue)
+        schedules = ArtistSchedules(session, Show, as_utc)
+        # for the /stats rollups, updated with each batch
+        places = {row_id: (city, state) for row_id, city, state in
+                  session.query(Venue.id, Venue.city, Venue.state).filter(Venue.hidden == False)}
+        genres = {}
+        for artist_id, genre in session.query(artist_genres.c.artist_id, artist_genres.c.genre):
+            genres.setdefault(artist_id, []).append(genre)
+
+    rejects = rejects or path + '.rejected.csv'
+    inserted = rejected = 0
+    started = time.time()
+    batch = []
+
+    with open(rejects, 'w', newline='') as rejects_file:
+        report = csv.writer(rejects_file)
+        report.writerow(['row', 'error', 'data'])
+
+        def reject(row_no, error, row):
+            report.writerow([row_no, error, json.dumps(row, default=str)])
+
+        def resolve(row, entity, ids, names):
+            value = row.get(entity + '_id')
+            if value not in (None, ''):
+                row_id = int(value) if str(value).isdigit() else None
+                return row_id if row_id in ids else None
+            return names.get(row.get(entity))
+
+        def build_show(form, row):
+            artist_id = resolve(row, 'artist', artist_ids, artist_names)
+            venue_id = resolve(row, 'venue', venue_ids, venue_names)
+            if artist_id is None or venue_id is None:
+                return None, 'unknown or ambiguous artist or venue'
+            start_time = as_utc(form.start_time.data)
+            end_time = start_time + timedelta(minutes=form.duration.data)
+            if schedules.conflicts(artist_id, start_time, end_time):
+                return None, 'artist is already booked at that time'
+            schedules.add(artist_id, start_time, end_time)
+            show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time, end_time=end_time)
+            return (show, None), None
+
+        def forget(record):
+            if kind == 'shows':
+                schedules.remove(record.artist_id, record.start_time)
+
+        def save(items):
+            records = [record for _, _, record, _ in items]
+            session.add_all(records)
+            session.flush()
+            links = [link for _, _, record, links_for in items if links_for for link in links_for(record)]
+            if links:
+                session.execute(link_table.insert(), links)
+            if kind == 'shows':
+                bump_show_stats(show_stat_counts([
+                    (show.venue_id,) + places[show.venue_id] + (show.start_time, show.artist_id)
+                    for show in records], genres))
+            session.commit()
+
+        def flush_batch():
+            nonlocal inserted, rejected
+            if not batch:
+                return
+            try:
+                save(batch)
+                inserted += len(batch)
+            except SQLAlchemyError:
+                # find the offending rows one at a time, keep the rest
+                session.rollback()
+                for item in batch:
+                    row_no, row, record, links_for = item
+                    try:
+                        save([(row_no, row, record.__class__(**{
+                            column.key: getattr(record, column.key)
+                            for column in record.__table__.columns if column.key != 'id'}), links_for)])
+                        inserted += 1
+                    except SQLAlchemyError as error:
+                        session.rollback()
+                        forget(record)
+                        reject(row_no, str(error.orig if hasattr(error, 'orig') else error), row)
+                        rejected += 1
+            del batch[:]
+            session.expunge_all()
+
+        for row_no, row in read_rows(path):
+            form = form_class(formdata=to_formdata(row), meta={'csrf': False})
+            if kind == 'shows':
+                # names are resolved below; give the form's DataRequired something to check
+                form.artist_id.data = form.artist_id.data or row.get('artist')
+                form.venue_id.data = form.venue_id.data or row.get('venue')
+            if not form.validate():
+                reject(row_no, form_errors(form), row)
+                rejected += 1
+                continue
+            if kind == 'shows':
+                built, error = build_show(form, row)
+                if error:
+                    reject(row_no, error, row)
+                    rejected += 1
+                    continue
+                record, links_for = built
+            else:
+                record, links_for = build(form)
+            batch.append((row_no, row, record, links_for))
+            if len(batch) >= batch_size:
+                flush_batch()
+        flush_batch()
+
+    elapsed = time.time() - started
+    click.echo('{} {}: {} inserted, {} rejected in {:.1f}s ({:.0f} rows/min)'.format(
+        kind, path, inserted, rejected, elapsed, (inserted + rejected) / elapsed * 60 if elapsed else 0))
+    if rejected:
+        click.echo('rejected rows written to {}'.format(rejects))
+
+
+#  Static assets
+#  ----------------------------------------------------------------
+
+@fyyur_cli.command('build-assets')
+def build_assets_command():
+    '''Fingerprint and precompress static/ into static/dist/.
+
+    Run at deploy time; restart the app afterwards so it loads the new
+    manifest.
+    '''
+    from flask import current_app
+
+    if brotli is None:
+        click.echo('warning: brotli is not installed, so no .br files are written; pip install brotli', err=True)
+    dist_dir = os.path.join(current_app.static_folder, 'dist')
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    manifest = build_assets(current_app.static_folder, dist_dir)
+    click.echo('{} assets written to {}'.format(len(manifest), dist_dir))
+
+
+#  Templates
+#  ----------------------------------------------------------------
+
+def time_template_loads(env, names):
+    # a fresh environment per load, so each one starts like a new worker
+    timings = {}
+    for name in names:
+        cold_env = env.overlay(cache_size=0)
+        started = time.perf_counter()
+        cold_env.get_template(name)
+        timings[name] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+@fyyur_cli.command('precompile-templates')
+@click.option('--benchmark', is_flag=True,
+              help='Also time loading each template from source and from the bytecode cache.')
+def precompile_templates(benchmark):
+    '''Compile every template into the bytecode cache, e.g. at build time.
+
+    Workers then load compiled templates instead of parsing and compiling
+    them on their first requests.
+    '''
+    from flask import current_app
+
+    env = current_app.jinja_env
+    if env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE_DIR is not set')
+    names = sorted(name for name in env.list_templates() if name.endswith('.html'))
+    env.bytecode_cache.clear()
+    for name in names:
+        env.overlay(cache_size=0).get_template(name)
+    click.echo('{} templates compiled into {}'.format(len(names), current_app.config['TEMPLATE_BYTECODE_CACHE_DIR']))
+
+    if benchmark:
+        from_source = time_template_loads(env.overlay(bytecode_cache=None), names)
+        from_cache = time_template_loads(env, names)
+        click.echo('{:<40} {:>12} {:>12}'.format('template', 'source ms', 'cached ms'))
+        for name in names:
+            click.echo('{:<40} {:>12.2f} {:>12.2f}'.format(name, from_source[name], from_cache[name]))
+        click.echo('{:<40} {:>12.2f} {:>12.2f}'.format(
+            'total', sum(from_source.values()), sum(from_cache.values())))
+
+
+#  Deleted venues
+#  ----------------------------------------------------------------
+
+@fyyur_cli.command('purge-venues')
+def purge_venues():
+    '''Finish deleting hidden venues now, rather than when a worker's first request resumes their purge.'''
+    from app import db, Venue, purge_venue_batch
+
+    for venue_id, in Venue.query.filter(Venue.hidden == True).with_entities(Venue.id).all():
+        deleted = 0
+        while True:
+            try:
+                rows = purge_venue_batch(venue_id)
+            except RuntimeError:
+                # a running app's purge worker deleted part of this batch; take the next one
+                db.session.rollback()
+                continue
+            if not rows:
+                break
+            deleted += rows
+        click.echo('venue {}: {} rows deleted'.format(venue_id, deleted))
+
+
+@fyyur_cli.command('fetch-images')
+def fetch_images():
+    '''Download remote venue and artist images so /img/ can serve thumbnails of them.'''
+    from flask import current_app
+    from app import Artist, Venue
+
+    originals_dir = current_app.config['IMAGE_ORIGINALS_DIR']
+    links = {link for model in (Venue, Artist)
+             for link, in model.query.with_entities(model.image_link).filter(model.image_link.isnot(None))}
+    fetched = failed = 0
+    for link in sorted(links):
+        if not link.startswith(('http://', 'https://')):
+            continue
+        try:
+            fetch_original(link, originals_dir)
+            fetched += 1
+        except (OSError, ValueError) as error:
+            failed += 1
+            click.echo('{}: {}'.format(link, error), err=True)
+    click.echo('{} images stored, {} failed'.format(fetched, failed))
+
+
+@fyyur_cli.command('rebuild-stats')
+def rebuild_stats():
+    '''Recount the /stats rollups from the shows table, e.g. if they have drifted.'''
+    from app import rebuild_show_stats
+
+    started = time.perf_counter()
+    buckets = rebuild_show_stats()
+    click.echo('{} buckets rebuilt in {:.1f}s'.format(buckets, time.perf_counter() - started))
@@ -1,8 +1,41 @@
 import os
-SECRET_KEY = os.urandom(32)
+import time
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def _local_secret_key(path):
+    # created once by whichever worker starts first, then read by the others
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # the creating worker may still be writing it
+        for _ in range(100):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if key:
+                return key
+            time.sleep(0.01)
+        raise RuntimeError('{} is empty'.format(path))
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+# Sessions, flash messages and CSRF tokens are signed with this key, so every
+# worker on every node needs the same one: set SECRET_KEY in the environment.
+# Without it a key is generated once and kept in instance/secret_key, which
+# covers the workers of a single machine.
+SECRET_KEY = os.environ.get('SECRET_KEY') or _local_secret_key(os.path.join(basedir, 'instance', 'secret_key'))
+
+# Server-side sessions: None keeps Flask's signed cookie sessions, 'sqlite'
+# stores them in SESSION_SQLITE_PATH (shared by the workers of one machine)
+# and 'memory' in the process (development only).
+SESSION_STORE = os.environ.get('SESSION_STORE')
+SESSION_SQLITE_PATH = os.path.join(basedir, 'instance', 'sessions.db')
+
 # Enable debug mode.
 DEBUG = True
 
@@ -10,4 +43,52 @@ DEBUG = True
 
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = '<Put your local database url>'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', '<Put your local database url>')
+
+# Compiled Jinja templates, warmed by `flask fyyur precompile-templates`; None disables
+TEMPLATE_BYTECODE_CACHE_DIR = os.path.join(basedir, 'instance', 'jinja')
+
+# Rendered venue and artist pages kept in memory per worker
+PAGE_CACHE_MAX_ENTRIES = 512
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# a version file per venue or artist, bumped by edits in any worker of this
+# machine; other machines' copies go stale after at most PAGE_CACHE_MAX_AGE seconds
+PAGE_CACHE_VERSIONS_DIR = os.path.join(basedir, 'instance', 'page_versions')
+PAGE_CACHE_MAX_AGE = 300
+
+# Shows rendered per /shows page
+SHOWS_PER_PAGE = 30
+
+# Venues or artists rendered per listing page
+LISTING_PER_PAGE = 50
+
+# Seconds the /areas venue and artist counts are cached for
+AREA_COUNTS_TTL = 300
+
+# Largest ?per_page= a listing accepts; pages are streamed, so memory stays flat
+LISTING_MAX_PER_PAGE = 5000
+
+# Logging (used when DEBUG is off): JSON lines written by a background thread
+LOG_FILE = os.path.join(basedir, 'error.log')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = 'midnight'
+LOG_BACKUP_COUNT = 14
+# records beyond this many waiting for the writer are dropped and counted
+LOG_QUEUE_SIZE = 10000
+
+# Deleted venues' shows are purged in the background this many rows per transaction
+PURGE_BATCH_SIZE = 1000
+PURGE_MAX_RETRIES = 5
+# a purge whose progress hasn't moved for this long is taken over by another worker
+PURGE_STALE_SECONDS = 60
+
+# /img/<entity>/<id> thumbnails: widths served, originals fetched by
+# `flask fyyur fetch-images`, and the on-disk cache of rendered images
+THUMBNAIL_WIDTHS = (200, 400, 800)
+IMAGE_ORIGINALS_DIR = os.path.join(basedir, 'instance', 'images', 'originals')
+THUMBNAIL_CACHE_DIR = os.path.join(basedir, 'instance', 'images', 'thumbnails')
+THUMBNAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+THUMBNAIL_MAX_AGE = 7 * 24 * 3600
+
+# Busiest venues listed on /stats
+STATS_TOP_VENUES = 10
@@ -0,0 +1,161 @@
+#----------------------------------------------------------------------------#
+# Image thumbnails.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from urllib.request import urlopen
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_FORMATS = {
+    # format: (Pillow format name, mimetype, save options)
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+
+def snap_width(width, widths):
+    # serve the smallest configured width that covers the request, so the cache has few variants
+    for candidate in sorted(widths):
+        if candidate >= width:
+            return candidate
+    return max(widths)
+
+
+def stored_original_path(originals_dir, image_link):
+    return os.path.join(originals_dir, hashlib.sha256(image_link.encode('utf-8')).hexdigest())
+
+
+def local_original(image_link, static_folder, originals_dir):
+    '''Path of the locally stored original for image_link, or None.
+
+    Links into /static are read straight from the static folder; remote
+    links must have been downloaded by `flask fyyur fetch-images`.
+    '''
+    if image_link.startswith('/static/'):
+        root = os.path.realpath(static_folder)
+        path = os.path.realpath(os.path.join(root, image_link[len('/static/'):]))
+        if path.startswith(root + os.sep) and os.path.isfile(path):
+            return path
+        return None
+    path = stored_original_path(originals_dir, image_link)
+    return path if os.path.isfile(path) else None
+
+
+def fetch_original(image_link, originals_dir, timeout=10):
+    # download a remote original into the store; returns its path
+    path = stored_original_path(originals_dir, image_link)
+    if os.path.isfile(path):
+        return path
+    os.makedirs(originals_dir, exist_ok=True)
+    with urlopen(image_link, timeout=timeout) as response:
+        with tempfile.NamedTemporaryFile(dir=originals_dir, delete=False) as f:
+            shutil.copyfileobj(response, f)
+    os.replace(f.name, path)
+    return path
+
+
+def render_thumbnail(original_path, width, image_format):
+    pil_format, _, options = THUMBNAIL_FORMATS[image_format]
+    with Image.open(original_path) as image:
+        image.draft('RGB', (width, width))  # lets JPEG decode at a reduced scale
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA') or (pil_format == 'JPEG' and image.mode != 'RGB'):
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        image.save(out, pil_format, **options)
+        return out.getvalue()
+
+
+class ThumbnailCache(object):
+    '''Content-addressed, size-bounded on-disk cache of rendered thumbnails.
+
+    A thumbnail is stored under a digest of (original content digest,
+    width, format), so a changed original gets new entries and stale ones
+    simply age out. Hits refresh the file's mtime; once the cache grows
+    past max_bytes the least recently used files are removed.
+    '''
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def original_digest(self, path):
+        # hashing a large original on every request would cost more than the resize saves
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            digest = self._digests[key] = sha.hexdigest()
+        return digest
+
+    def key(self, original_path, width, image_format):
+        source = '{}:{}:{}'.format(self.original_digest(original_path), width, image_format)
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._files())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def _evict(self):
+        # drop least recently used files until the cache is back under 90% of its budget
+        files = sorted(self._files())
+        self._size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
@@ -0,0 +1,140 @@
+#----------------------------------------------------------------------------#
+# Background batch jobs.
+#----------------------------------------------------------------------------#
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJobWorker(object):
+    '''Run batched jobs one after another on a daemon thread.
+
+    A job is a function that does one bounded batch of work per call, in
+    its own transaction, and returns how many rows it handled; 0 means it
+    is finished. A failing batch is retried with exponential backoff, so
+    a transient error costs one batch rather than the whole job.
+
+    Progress is kept in the model's table (key, state, rows, batches,
+    retries, error, updated_at), so any worker process can report it.
+    A job is claimed with one conditional UPDATE before it runs, and its
+    updated_at is refreshed after every batch; a running job not updated
+    for stale_after seconds was left by a process that died, and can be
+    claimed again.
+    '''
+
+    def __init__(self, app, db, model, max_retries=5, backoff=0.5, stale_after=60):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stale_after = stale_after
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._resumed = False
+
+    def submit(self, key, step):
+        '''Record key as queued and run step on the worker thread.'''
+        self.db.session.merge(self.model(key=key, state='queued', rows=0, batches=0, retries=0, error=None,
+                                         updated_at=self._now()))
+        self.db.session.commit()
+        self._put(key, step)
+
+    def resume(self, pending):
+        '''Once per process, queue the jobs pending() returns as (key, step) pairs.
+
+        Those another live process is running are skipped when claimed.
+        '''
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+        self._put(None, pending)
+
+    def status(self, key):
+        job = self.db.session.query(self.model).get(key)
+        if job is None:
+            return None
+        return {'state': job.state, 'rows': job.rows, 'batches': job.batches, 'retries': job.retries,
+                'error': job.error}
+
+    def _put(self, key, step):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='batch-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put((key, step))
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def _update(self, key, **changes):
+        self.db.session.query(self.model).filter(self.model.key == key) \
+            .update(dict(changes, updated_at=self._now()), synchronize_session=False)
+        self.db.session.commit()
+
+    def _claim(self, key):
+        model = self.model
+        stale = self._now() - timedelta(seconds=self.stale_after)
+        claimed = self.db.session.query(model).filter(
+            model.key == key,
+            model.state.in_(('queued', 'failed')) | ((model.state == 'running') & (model.updated_at < stale)),
+        ).update({'state': 'running', 'updated_at': self._now()}, synchronize_session=False)
+        self.db.session.commit()
+        return claimed == 1
+
+    def _work(self):
+        while True:
+            key, step = self._queue.get()
+            with self.app.app_context():
+                try:
+                    if key is None:
+                        self._queue_pending(step)
+                    elif self._claim(key):
+                        self.run(key, step)
+                except Exception:
+                    logger.exception('job %s could not be started', key)
+                finally:
+                    self.db.session.remove()
+
+    def _queue_pending(self, pending):
+        for key, step in pending():
+            if self.db.session.query(self.model).get(key) is None:
+                self.db.session.add(self.model(key=key, state='queued', rows=0, batches=0, retries=0,
+                                               updated_at=self._now()))
+                try:
+                    self.db.session.commit()
+                except IntegrityError:
+                    # another process recorded it first; whoever claims it runs it
+                    self.db.session.rollback()
+            self._queue.put((key, step))
+
+    def run(self, key, step):
+        attempt = 0
+        while True:
+            try:
+                rows = step()
+            except Exception as error:
+                self.db.session.rollback()
+                attempt += 1
+                self._update(key, retries=self.model.retries + 1, error=str(error))
+                if attempt > self.max_retries:
+                    self._update(key, state='failed')
+                    logger.exception('job %s failed after %d attempts', key, attempt)
+                    return
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+            attempt = 0
+            if not rows:
+                self._update(key, state='done', error=None)
+                return
+            self._update(key, rows=self.model.rows + rows, batches=self.model.batches + 1)
@@ -0,0 +1,142 @@
+#----------------------------------------------------------------------------#
+# Non-blocking logging.
+#
+# Request threads only put records on a bounded queue; a QueueListener
+# thread formats them as JSON lines and writes them to a file rotated by
+# size and by time. When the queue is full (e.g. the disk stalls) records
+# are dropped and counted instead of blocking the request.
+#----------------------------------------------------------------------------#
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def prepare(self, record):
+        # keep message and traceback as separate text fields for the JSON formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class RequestContextFilter(logging.Filter):
+    # runs on the request thread, before the record leaves it
+
+    def filter(self, record):
+        if has_request_context():
+            record.route = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ('route', 'method', 'path', 'status', 'latency_ms')
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'source': '{}:{}'.format(record.pathname, record.lineno),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    '''Rotate on the TimedRotatingFileHandler schedule or once the file reaches max_bytes.'''
+
+    def __init__(self, filename, max_bytes=0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def rotation_filename(self, default_name):
+        # a size rollover reuses the current period's suffix; don't overwrite the earlier file
+        name = super().rotation_filename(default_name)
+        candidate, n = name, 1
+        while os.path.exists(candidate):
+            candidate = '{}.{}'.format(name, n)
+            n += 1
+        return candidate
+
+
+def setup_logging(app):
+    '''Send app.logger through a background writer and log every request with its latency.'''
+    file_handler = SizedTimedRotatingFileHandler(
+        app.config['LOG_FILE'],
+        max_bytes=app.config['LOG_MAX_BYTES'],
+        when=app.config['LOG_ROTATE_WHEN'],
+        backupCount=app.config['LOG_BACKUP_COUNT'],
+        delay=True,
+    )
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']))
+    queue_handler.addFilter(RequestContextFilter())
+    listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    app.logger.setLevel(logging.INFO)
+    # flask's stderr handler would still write synchronously on the request thread
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            app.logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+        return response
+
+    return queue_handler
@@ -0,0 +1,155 @@
+#----------------------------------------------------------------------------#
+# Server-side sessions.
+#
+# With SESSION_STORE set, the session cookie only carries a signed random
+# id and the session itself (flash messages, the CSRF token) lives in a
+# store shared by the workers: a SQLite file on the node, or memory for a
+# single process. Without it Flask's signed cookie sessions are used, which
+# work across any number of workers and nodes as long as they share
+# SECRET_KEY.
+#----------------------------------------------------------------------------#
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+
+
+class MemorySessionStore(object):
+    '''Sessions in a dict: one process only, for development and tests.'''
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def set(self, sid, data, expires):
+        with self._lock:
+            self._sessions[sid] = (data, expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SqliteSessionStore(object):
+    '''Sessions in a SQLite file shared by the workers of one node.'''
+
+    # expired rows are swept on roughly one write in this many
+    SWEEP_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS sessions '
+                               '(id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=10)
+            # readers don't wait for the writer
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def get(self, sid):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE id = ? AND expires >= ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, expires):
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)',
+                               (sid, data, expires))
+            if secrets.randbelow(self.SWEEP_EVERY) == 0:
+                connection.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+    def delete(self, sid):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='fyyur-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            data = sid and self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified and not self.should_set_cookie(app, session):
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        expires = self.get_expiration_time(app, session)
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       expires.timestamp() if expires else time.time() + lifetime)
+        response.set_cookie(
+            name, self._signer(app).sign(session.sid).decode('ascii'), expires=expires,
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        response.vary.add('Cookie')
+
+
+def init_sessions(app):
+    '''Install the server-side session store named by SESSION_STORE, if any.'''
+    kind = app.config.get('SESSION_STORE')
+    if not kind:
+        return None
+    if kind == 'sqlite':
+        store = SqliteSessionStore(app.config['SESSION_SQLITE_PATH'])
+    elif kind == 'memory':
+        store = MemorySessionStore()
+    else:
+        raise ValueError('unknown SESSION_STORE {!r}'.format(kind))
+    app.session_interface = ServerSideSessionInterface(store)
+    return store
@@ -0,0 +1,732 @@
+import csv
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+
+from cache import PageCache
+from images import ThumbnailCache
+from jobs import BatchJobWorker
+from sessions import ServerSideSessionInterface, SqliteSessionStore
+
+# app.py reads its database from config at import time
+database_file = os.path.join(tempfile.mkdtemp(), 'fyyur_test.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + database_file)
+
+import config
+from app import app, as_utc, db, page_cache, pending_purges, purge_job_key, rebuild_show_stats, thumbnail_cache, Artist, BatchJob, \
+    Genre, Show, ShowStat, Venue
+
+
+class EditConcurrencyTestCase(unittest.TestCase):
+    """Optimistic-concurrency edits of artists"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                            facebook_link='https://www.facebook.com/GunsNPetals',
+                            genres=[Genre.query.get('Rock n Roll')])
+            db.session.add(artist)
+            db.session.commit()
+            self.artist_id = artist.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def edit(self, name, version):
+        return self.client().post('/artists/{}/edit'.format(self.artist_id), data={
+            'name': name,
+            'city': 'San Francisco',
+            'state': 'CA',
+            'genres': ['Jazz'],
+            'facebook_link': 'https://www.facebook.com/GunsNPetals',
+            'version': version,
+        })
+
+    def test_edit_bumps_version(self):
+        res = self.edit('Guns N Roses', 1)
+        self.assertEqual(res.status_code, 302)
+
+        res = self.edit('Guns N Lilies', 2)
+        self.assertEqual(res.status_code, 302)
+
+        with app.app_context():
+            artist = Artist.query.get(self.artist_id)
+            self.assertEqual(artist.name, 'Guns N Lilies')
+            self.assertEqual(artist.version, 3)
+            self.assertEqual([genre.name for genre in artist.genres], ['Jazz'])
+
+    def test_409_for_stale_version(self):
+        self.edit('Guns N Roses', 1)
+        res = self.edit('Guns N Lilies', 1)
+
+        self.assertEqual(res.status_code, 409)
+        with app.app_context():
+            self.assertEqual(Artist.query.get(self.artist_id).name, 'Guns N Roses')
+
+    def test_404_for_missing_artist(self):
+        res = self.client().post('/artists/999/edit', data={
+            'name': 'Nobody', 'city': 'Nowhere', 'state': 'CA', 'genres': ['Jazz'],
+            'facebook_link': 'https://www.facebook.com/nobody', 'version': 1,
+        })
+        self.assertEqual(res.status_code, 404)
+
+    def test_parallel_writers_only_one_wins(self):
+        writers = 8
+        start = threading.Barrier(writers)
+        statuses = {}
+
+        def write(n):
+            start.wait()
+            statuses[n] = self.edit('Writer {}'.format(n), 1).status_code
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [n for n, status in statuses.items() if status == 302]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(sorted(statuses.values()), [302] + [409] * (writers - 1))
+        with app.app_context():
+            artist = Artist.query.get(self.artist_id)
+            self.assertEqual(artist.name, 'Writer {}'.format(winners[0]))
+            self.assertEqual(artist.version, 2)
+
+
+class ShowConflictTestCase(unittest.TestCase):
+    """An artist can't be booked for two overlapping shows"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street')
+            artists = [Artist(name=name, city='San Francisco', state='CA') for name in ('Guns N Petals', 'Matt Quevedo')]
+            db.session.add_all([venue] + artists)
+            db.session.commit()
+            self.venue_id = venue.id
+            self.artist_ids = [artist.id for artist in artists]
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def book(self, start_time, duration=120, artist=0):
+        return self.client().post('/shows/create', data={
+            'artist_id': self.artist_ids[artist], 'venue_id': self.venue_id,
+            'start_time': start_time, 'duration': duration,
+        })
+
+    def shows(self):
+        with app.app_context():
+            return Show.query.count()
+
+    def test_overlap_starting_earlier_is_refused(self):
+        self.book('2035-04-01 20:00:00')
+        res = self.book('2035-04-01 19:00:00')
+        self.assertIn(b'is already playing', res.data)
+        self.assertEqual(self.shows(), 1)
+
+    def test_back_to_back_shows_are_allowed(self):
+        self.book('2035-04-01 20:00:00')
+        self.book('2035-04-01 22:00:00')
+        self.book('2035-04-01 18:00:00')
+        self.assertEqual(self.shows(), 3)
+
+    def test_other_artist_can_take_the_same_slot(self):
+        self.book('2035-04-01 20:00:00')
+        self.book('2035-04-01 20:00:00', artist=1)
+        self.assertEqual(self.shows(), 2)
+
+
+class PageCacheTestCase(unittest.TestCase):
+    """Rendered pages cached per entity version"""
+
+    def setUp(self):
+        self.versions_dir = tempfile.mkdtemp()
+
+    def worker(self, max_age=None):
+        return PageCache(versions_dir=self.versions_dir, max_age=max_age)
+
+    def test_page_rendered_before_a_bump_is_not_stored(self):
+        cache = self.worker()
+        version = cache.version('venue', 1)
+        cache.bump('venue', 1)
+        cache.set('venue', 1, 'stale page', version)
+        self.assertIsNone(cache.get('venue', 1))
+
+    def test_bump_in_one_worker_invalidates_the_others(self):
+        cache, other = self.worker(), self.worker()
+        other.set('venue', 1, 'page', other.version('venue', 1))
+        self.assertEqual(other.get('venue', 1), 'page')
+        cache.bump('venue', 1)
+        self.assertIsNone(other.get('venue', 1))
+
+    def test_pages_expire_after_max_age(self):
+        cache = self.worker(max_age=0)
+        cache.set('venue', 1, 'page', cache.version('venue', 1))
+        self.assertIsNone(cache.get('venue', 1))
+
+
+class ThumbnailTestCase(unittest.TestCase):
+    """Resized images served from /img/<entity>/<id>"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client
+        thumbnail_cache.directory = tempfile.mkdtemp()
+        thumbnail_cache._size = None
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            venue = Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                          address='1015 Folsom Street', image_link='/static/img/front-splash.jpg')
+            artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                            image_link='https://images.example.com/guns-n-petals.jpg')
+            db.session.add_all([venue, artist])
+            db.session.commit()
+            self.venue_id, self.artist_id = venue.id, artist.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_resizes_to_configured_width(self):
+        res = self.client().get('/img/venue/{}?w=350'.format(self.venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(res.data)).width, 400)
+        self.assertIn('max-age', res.headers['Cache-Control'])
+
+    def test_webp_when_accepted(self):
+        res = self.client().get('/img/venue/{}?w=200'.format(self.venue_id),
+                                headers={'Accept': 'image/webp,image/*'})
+
+        self.assertEqual(res.mimetype, 'image/webp')
+        self.assertIn('Accept', res.headers['Vary'])
+
+    def test_304_for_matching_etag(self):
+        url = '/img/venue/{}?w=200'.format(self.venue_id)
+        etag = self.client().get(url).headers['ETag']
+
+        res = self.client().get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_redirects_until_original_is_fetched(self):
+        res = self.client().get('/img/artist/{}?w=200'.format(self.artist_id))
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(res.headers['Location'], 'https://images.example.com/guns-n-petals.jpg')
+
+    def test_evicts_least_recently_used(self):
+        cache = ThumbnailCache(tempfile.mkdtemp(), max_bytes=2500)
+        thumbnail = b'x' * 1000
+        older, newer = cache.put('older', thumbnail), cache.put('newer', thumbnail)
+        os.utime(older, (1000, 1000))
+        os.utime(newer, (2000, 2000))
+        # reading the older thumbnail makes the other one least recently used
+        self.assertEqual(cache.get('older'), thumbnail)
+
+        cache.put('third', thumbnail)
+        self.assertTrue(os.path.exists(older))
+        self.assertFalse(os.path.exists(newer))
+        self.assertEqual(cache.get('third'), thumbnail)
+
+
+class StatsTestCase(unittest.TestCase):
+    """Booking rollups kept in step with shows"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                          facebook_link='https://www.facebook.com/TheMusicalHop', genres=[Genre.query.get('Jazz')])
+            artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                            facebook_link='https://www.facebook.com/GunsNPetals',
+                            genres=[Genre.query.get('Rock n Roll'), Genre.query.get('Folk')])
+            db.session.add_all([venue, artist])
+            db.session.commit()
+            self.venue_id, self.artist_id = venue.id, artist.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def book(self, start_time):
+        return self.client().post('/shows/create', data={
+            'artist_id': self.artist_id, 'venue_id': self.venue_id,
+            'start_time': start_time, 'duration': 120,
+        })
+
+    def rollups(self):
+        with app.app_context():
+            return {(stat.dimension, stat.bucket): stat.shows for stat in ShowStat.query if stat.shows}
+
+    def purge_state(self, status_url):
+        while True:
+            state = self.client().get(status_url).get_json()['state']
+            if state not in ('queued', 'running'):
+                return state
+            time.sleep(0.01)
+
+    def test_booking_updates_rollups(self):
+        self.book('2035-04-01 20:00:00')
+        self.book('2035-04-08 20:00:00')
+        self.book('2035-05-01 20:00:00')
+
+        self.assertEqual(self.rollups(), {
+            ('month', '2035-04'): 2,
+            ('month', '2035-05'): 1,
+            ('city', 'San Francisco, CA'): 3,
+            ('venue', str(self.venue_id)): 3,
+            ('genre', 'Rock n Roll'): 3,
+            ('genre', 'Folk'): 3,
+        })
+        res = self.client().get('/stats')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'The Musical Hop', res.data)
+
+    def test_edits_move_counts(self):
+        self.book('2035-04-01 20:00:00')
+        self.client().post('/venues/{}/edit'.format(self.venue_id), data={
+            'name': 'The Musical Hop', 'city': 'Oakland', 'state': 'CA', 'address': '1015 Folsom Street',
+            'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/TheMusicalHop', 'version': 1,
+        })
+        self.client().post('/artists/{}/edit'.format(self.artist_id), data={
+            'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Folk', 'Blues'],
+            'facebook_link': 'https://www.facebook.com/GunsNPetals', 'version': 1,
+        })
+
+        rollups = self.rollups()
+        self.assertNotIn(('city', 'San Francisco, CA'), rollups)
+        self.assertEqual(rollups[('city', 'Oakland, CA')], 1)
+        self.assertNotIn(('genre', 'Rock n Roll'), rollups)
+        self.assertEqual(rollups[('genre', 'Blues')], 1)
+        with app.app_context():
+            rebuild_show_stats()
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_deleted_venue_is_counted_down(self):
+        self.book('2035-04-01 20:00:00')
+        self.book('2035-04-08 20:00:00')
+
+        res = self.client().delete('/venues/{}'.format(self.venue_id))
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(self.purge_state(res.get_json()['status_url']), 'done')
+        self.assertEqual(self.rollups(), {})
+
+    def test_purge_progress_is_shared_by_workers(self):
+        self.book('2035-04-01 20:00:00')
+        status_url = self.client().delete('/venues/{}'.format(self.venue_id)).get_json()['status_url']
+        self.purge_state(status_url)
+
+        with app.app_context():
+            # a worker process that didn't take the DELETE
+            other_worker = BatchJobWorker(app, db, BatchJob)
+            self.assertEqual(other_worker.status(purge_job_key(self.venue_id)),
+                             {'state': 'done', 'rows': 2, 'batches': 2, 'retries': 0, 'error': None})
+
+    def test_unfinished_purge_resumed_by_a_new_worker(self):
+        self.book('2035-04-01 20:00:00')
+        with app.app_context():
+            # hidden by a process that exited while purging it
+            Venue.query.filter(Venue.id == self.venue_id).update({'hidden': True})
+            db.session.add(BatchJob(key=purge_job_key(self.venue_id), state='running',
+                                    updated_at=datetime.now(timezone.utc) - timedelta(minutes=5)))
+            db.session.commit()
+            BatchJobWorker(app, db, BatchJob, stale_after=60).resume(pending_purges)
+
+        self.assertEqual(self.purge_state('/venues/{}/delete-status'.format(self.venue_id)), 'done')
+        with app.app_context():
+            self.assertIsNone(Venue.query.get(self.venue_id))
+            self.assertEqual(Show.query.count(), 0)
+
+    def test_rebuild_matches_incremental(self):
+        for day in range(1, 6):
+            self.book('2035-0{}-01 20:00:00'.format(day))
+        incremental = self.rollups()
+
+        with app.app_context():
+            ShowStat.query.delete()
+            db.session.commit()
+            rebuild_show_stats()
+        self.assertEqual(self.rollups(), incremental)
+
+
+class StreamingListingTestCase(unittest.TestCase):
+    """Listing pages streamed as they render"""
+
+    shows = 3000
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            venues = [Venue(name='Venue {}'.format(n), city='City {}'.format(n % 7), state='CA', address='1 Main St')
+                      for n in range(50)]
+            artists = [Artist(name='Artist {}'.format(n), city='San Francisco', state='CA') for n in range(100)]
+            db.session.add_all(venues + artists)
+            db.session.commit()
+            start = datetime(2035, 1, 1, tzinfo=timezone.utc)
+            db.session.execute(Show.__table__.insert(), [{
+                'venue_id': venues[n % 50].id, 'artist_id': artists[n % 100].id,
+                'start_time': start + timedelta(hours=3 * n), 'end_time': start + timedelta(hours=3 * n + 2),
+            } for n in range(self.shows)])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_layout_sent_before_rows(self):
+        res = self.client().get('/shows?per_page=1000')
+        chunks = iter(res.response)
+        head = b''
+        for chunk in chunks:
+            if b'tile-show' in chunk:
+                break
+            head += chunk
+        self.assertIn(b'navbar', head)
+        res.close()
+
+    def test_peak_memory_flat_in_page_length(self):
+        def peak(per_page):
+            tracemalloc.start()
+            res = self.client().get('/shows?per_page={}'.format(per_page))
+            size = sum(len(chunk) for chunk in res.response)
+            res.close()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return size, peak
+
+        short_size, short_peak = peak(300)
+        long_size, long_peak = peak(self.shows)
+        self.assertGreater(long_size, 9 * short_size)
+        self.assertLess(long_peak, 2 * short_peak)
+
+    def test_bad_date_filters_are_400(self):
+        for query in ('from=99999999999999999999', 'to=not-a-date', 'after=2035-01-01_x'):
+            self.assertEqual(self.client().get('/shows?' + query).status_code, 400, query)
+
+    def test_flash_shown_on_one_streamed_page(self):
+        client = self.client()
+        with client.session_transaction() as session:
+            session['_flashes'] = [('message', 'Show was successfully listed!')]
+        self.assertIn(b'Show was successfully listed!', client.get('/shows').data)
+        self.assertNotIn(b'Show was successfully listed!', client.get('/shows').data)
+        self.assertNotIn(b'Show was successfully listed!', client.get('/').data)
+
+    def test_venue_pages_cover_every_venue_once(self):
+        seen = []
+        url = '/venues?per_page=8'
+        while url:
+            res = self.client().get(url)
+            body = res.get_data(as_text=True)
+            seen += re.findall(r'href="/venues/(\d+)"', body)
+            match = re.search(r'href="(/venues\?[^"]+)">More venues', body)
+            url = match and match.group(1).replace('&amp;', '&')
+        self.assertEqual(len(seen), 50)
+        self.assertEqual(len(set(seen)), 50)
+
+
+class GenreListingTestCase(unittest.TestCase):
+    """Venues and artists of one genre, paged on the genre link tables"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            jazz, folk = Genre.query.get('Jazz'), Genre.query.get('Folk')
+            db.session.add_all([Venue(name='Venue {}'.format(n), city='City {}'.format(n % 3), state='CA',
+                                      address='1 Main St', genres=[jazz if n % 2 else folk]) for n in range(20)])
+            db.session.add_all([Artist(name='Artist {}'.format(n), city='San Francisco', state='CA',
+                                       genres=[jazz if n % 2 else folk]) for n in range(20)])
+            db.session.commit()
+            self.jazz_venues = [venue.id for venue in Venue.query.order_by(Venue.id) if venue.name[-1] in '13579']
+            self.jazz_artists = [artist.id for artist in Artist.query.order_by(Artist.id)
+                                 if artist.name[-1] in '13579']
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def listed(self, url, kind):
+        ids = []
+        while url:
+            body = self.client().get(url).get_data(as_text=True)
+            ids += [int(id) for id in re.findall(r'href="/{}/(\d+)"'.format(kind), body)]
+            match = re.search(r'href="(/{}\?[^"]+)">More'.format(kind), body)
+            url = match and match.group(1).replace('&amp;', '&')
+        return ids
+
+    def plans(self, url):
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if 'genres' in statement and 'LIMIT' in statement:
+                statements.append((statement, parameters))
+        with app.app_context():
+            db.event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                self.client().get(url).get_data()
+            finally:
+                db.event.remove(db.engine, 'before_cursor_execute', capture)
+            self.assertTrue(statements)
+            connection = db.engine.raw_connection()
+            try:
+                return [' '.join(row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+                        for statement, parameters in statements]
+            finally:
+                connection.close()
+
+    def test_genre_pages_list_each_in_id_order(self):
+        self.assertEqual(self.listed('/venues?genre=Jazz&per_page=3', 'venues'), self.jazz_venues)
+        self.assertEqual(self.listed('/artists?genre=Jazz&per_page=3', 'artists'), self.jazz_artists)
+
+    def test_genre_pages_are_read_in_index_order(self):
+        for url in ('/venues?genre=Jazz&after={}'.format(self.jazz_venues[2]),
+                    '/artists?genre=Jazz&after={}'.format(self.jazz_artists[2])):
+            for plan in self.plans(url):
+                self.assertNotIn('TEMP B-TREE', plan, url)
+
+
+class ImportTestCase(unittest.TestCase):
+    """Bulk imports with `flask fyyur import`"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.directory = tempfile.mkdtemp()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', genres=[Genre.query.get('Jazz')])
+            db.session.add(artist)
+            db.session.commit()
+            self.artist_id = artist.id
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def run_import(self, kind, name, rows, *options):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as f:
+            if name.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+        result = app.test_cli_runner().invoke(args=['fyyur', 'import', kind, path] + list(options))
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(path + '.rejected.csv', newline='') as f:
+            rejects = {int(row['row']): row['error'] for row in csv.DictReader(f)}
+        return result.output, rejects
+
+    def venue(self, name, **fields):
+        return dict({'name': name, 'city': 'San Francisco', 'state': 'CA', 'address': '1 Main St',
+                     'genres': 'Jazz, Folk', 'facebook_link': 'https://www.facebook.com/venue'}, **fields)
+
+    def refuse(self, table, column, value):
+        # a row the database itself rejects, which the forms can't catch
+        with app.app_context():
+            db.session.execute(db.text(
+                'CREATE TRIGGER refuse_{0} BEFORE INSERT ON "{0}" WHEN NEW.{1} = {2!r} '
+                "BEGIN SELECT RAISE(ABORT, 'refused'); END".format(table, column, value)))
+            db.session.commit()
+
+    def test_import_venues_with_rejected_rows(self):
+        self.refuse('Venue', 'name', 'Refused Hall')
+        output, rejects = self.run_import('venues', 'venues.csv', [
+            self.venue('The Musical Hop'),
+            self.venue('No State', state='XX'),
+            self.venue('Refused Hall'),
+            self.venue('Park Square', genres='Folk'),
+        ], '--batch-size', '3')
+
+        self.assertIn('2 inserted, 2 rejected', output)
+        self.assertEqual(sorted(rejects), [3, 4])
+        self.assertIn('state', rejects[3])
+        self.assertIn('refused', rejects[4])
+        with app.app_context():
+            venues = {venue.name: sorted(genre.name for genre in venue.genres) for venue in Venue.query}
+        self.assertEqual(venues, {'The Musical Hop': ['Folk', 'Jazz'], 'Park Square': ['Folk']})
+
+    def test_import_shows_by_name_and_id(self):
+        self.run_import('venues', 'venues.csv', [self.venue('The Musical Hop'), self.venue('Refused Hall'),
+                                                 self.venue('Park Square')])
+        with app.app_context():
+            refused_id = Venue.query.filter(Venue.name == 'Refused Hall').one().id
+        self.refuse('Show', 'venue_id', refused_id)
+
+        output, rejects = self.run_import('shows', 'shows.jsonl', [
+            {'artist': 'Guns N Petals', 'venue': 'The Musical Hop', 'start_time': '2035-04-01 20:00:00',
+             'duration': 120},
+            # double-books the show above
+            {'artist_id': self.artist_id, 'venue': 'Park Square', 'start_time': '2035-04-01 21:00:00',
+             'duration': 60},
+            {'artist': 'Guns N Petals', 'venue': 'Nowhere', 'start_time': '2035-04-02 20:00:00', 'duration': 60},
+            # refused by the database, in the second batch, so rows are retried one at a time
+            {'artist': 'Guns N Petals', 'venue_id': refused_id, 'start_time': '2035-04-03 20:00:00',
+             'duration': 60},
+            # the refused show doesn't count as a booking
+            {'artist': 'Guns N Petals', 'venue': 'Park Square', 'start_time': '2035-04-03 20:00:00',
+             'duration': 60},
+        ], '--batch-size', '2')
+
+        self.assertIn('2 inserted, 3 rejected', output)
+        self.assertEqual(sorted(rejects), [2, 3, 4])
+        self.assertEqual(rejects[2], 'artist is already booked at that time')
+        self.assertEqual(rejects[3], 'unknown or ambiguous artist or venue')
+        self.assertIn('refused', rejects[4])
+        with app.app_context():
+            shows = [(show.venue.name, as_utc(show.start_time)) for show in Show.query.order_by(Show.start_time)]
+            stats = {(stat.dimension, stat.bucket): stat.shows for stat in ShowStat.query if stat.shows}
+        self.assertEqual(shows, [('The Musical Hop', datetime(2035, 4, 1, 20, tzinfo=timezone.utc)),
+                                 ('Park Square', datetime(2035, 4, 3, 20, tzinfo=timezone.utc))])
+        self.assertEqual(stats[('month', '2035-04')], 2)
+
+
+class SessionStoreTestCase(unittest.TestCase):
+    """Sessions shared by workers through a server-side store"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.path = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+        self.default_interface = app.session_interface
+
+    def tearDown(self):
+        app.session_interface = self.default_interface
+
+    def worker(self):
+        # each worker process opens the store itself
+        app.session_interface = ServerSideSessionInterface(SqliteSessionStore(self.path))
+        return app.test_client()
+
+    def test_flash_survives_switching_workers(self):
+        client = self.worker()
+        with client.session_transaction() as session:
+            session['_flashes'] = [('message', 'Venue The Dueling Pianos Bar was successfully listed!')]
+        cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+        self.assertLess(len(cookie.value), 100)
+
+        other = self.worker()
+        other.set_cookie(app.config['SESSION_COOKIE_NAME'], cookie.value)
+        res = other.get('/')
+        self.assertIn(b'was successfully listed!', res.data)
+        # shown once, then gone from the store
+        self.assertNotIn(b'was successfully listed!', other.get('/').data)
+
+    def test_tampered_cookie_gets_empty_session(self):
+        client = self.worker()
+        with client.session_transaction() as session:
+            session['user'] = 'admin'
+        sid = client.get_cookie(app.config['SESSION_COOKIE_NAME']).value.split('.')[0]
+        client.set_cookie(app.config['SESSION_COOKIE_NAME'], sid + '.forged')
+        with client.session_transaction() as session:
+            self.assertNotIn('user', session)
+
+    def test_secret_key_stable_across_imports(self):
+        key = config.SECRET_KEY
+        self.assertEqual(importlib.reload(config).SECRET_KEY, key)
+
+
+class AreasTestCase(unittest.TestCase):
+    """Browsing venues and artists by state and city"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client
+        page_cache.clear()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add_all([Venue(name='Venue {:02}'.format(n), city='San Francisco', state='CA',
+                                      address='1 Main St', hidden=(n == 0)) for n in range(12)])
+            db.session.add_all([Artist(name='Artist {:02}'.format(n), city='New York', state='NY',
+                                       facebook_link='https://www.facebook.com/artist{}'.format(n),
+                                       genres=[Genre.query.get('Jazz')]) for n in range(3)])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_counts_per_state_and_city(self):
+        body = self.client().get('/areas').get_data(as_text=True)
+
+        self.assertIn('CA <small>11 venues, 0 artists</small>', body)
+        self.assertIn('NY <small>0 venues, 3 artists</small>', body)
+
+    def test_venue_without_city_is_left_out(self):
+        with app.app_context():
+            db.session.add(Venue(name='Nowhere', city=None, state='CA', address='1 Main St'))
+            db.session.commit()
+
+        res = self.client().get('/areas')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('CA <small>11 venues, 0 artists</small>', res.get_data(as_text=True))
+
+    def test_counts_follow_edits(self):
+        self.client().get('/areas')
+        with app.app_context():
+            artist_id = Artist.query.filter(Artist.name == 'Artist 00').one().id
+        self.client().post('/artists/{}/edit'.format(artist_id), data={
+            'name': 'Artist 00', 'city': 'San Francisco', 'state': 'CA', 'genres': ['Jazz'],
+            'facebook_link': 'https://www.facebook.com/artist0', 'version': 1,
+        })
+
+        body = self.client().get('/areas').get_data(as_text=True)
+        self.assertIn('CA <small>11 venues, 1 artists</small>', body)
+
+    def test_city_pages_list_every_venue_once_by_name(self):
+        names = []
+        url = '/areas/CA/San Francisco?per_page=5'
+        while url:
+            body = self.client().get(url).get_data(as_text=True)
+            names += re.findall(r'<h5>(Venue \d+)</h5>', body)
+            match = re.search(r'href="([^"]+)">More venues', body)
+            url = match and match.group(1).replace('&amp;', '&')
+        self.assertEqual(names, ['Venue {:02}'.format(n) for n in range(1, 12)])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
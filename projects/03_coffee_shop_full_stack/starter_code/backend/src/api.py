@@ -1,14 +1,45 @@
 import os
-from flask import Flask, request, jsonify, abort
-import json
+import time
+import click
+from flask import Flask, request, jsonify, abort, Response
 from flask_cors import CORS
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
+from .database.recipes import RecipeError
+from .database.models import db_drop_and_create_all, setup_db, db, Drink, Ingredient, Order, Stock, data_dir
+from sqlalchemy.exc import IntegrityError
+from .auth.auth import AuthError, requires_auth, check_permissions
+from .cache import MenuSnapshots, encode_drinks
+from .orders import init_orders
+from .inventory import compiled_menu, forecast, forecast_since
 
 app = Flask(__name__)
 setup_db(app)
 CORS(app)
 
+# seconds browsers and proxies may reuse the public menu before revalidating
+app.config['DRINKS_MAX_AGE'] = int(os.environ.get('DRINKS_MAX_AGE', 60))
+
+
+def load_menu():
+    drinks = Drink.query.order_by(Drink.id).all()
+    return [drink.short() for drink in drinks], [drink.long() for drink in drinks]
+
+
+# the menu as served, rebuilt only after a drink is created, changed or deleted
+menu = MenuSnapshots(os.path.join(data_dir, 'menu.version'),
+                     os.path.join(data_dir, 'menu.snapshot'), load_menu)
+
+# orders: stations preparing them at once, seconds each drink takes, and
+# how long new orders and status changes may wait to be committed together
+app.config['ORDER_STATIONS'] = int(os.environ.get('ORDER_STATIONS', 4))
+app.config['ORDER_PREPARE_SECONDS'] = float(os.environ.get('ORDER_PREPARE_SECONDS', 1))
+app.config['ORDER_COMMIT_INTERVAL'] = float(os.environ.get('ORDER_COMMIT_INTERVAL', 0.05))
+init_orders(app)
+
+# seconds of recent orders the inventory forecast takes the rate of use from
+app.config['INVENTORY_FORECAST_WINDOW'] = float(os.environ.get('INVENTORY_FORECAST_WINDOW', 3600))
+# seconds of orders a stock count is charged for at most, which bounds the orders the forecast reads
+app.config['INVENTORY_COUNT_MAX_AGE'] = float(os.environ.get('INVENTORY_COUNT_MAX_AGE', 7 * 24 * 3600))
+
 '''
 @TODO uncomment the following line to initialize the datbase
 !! NOTE THIS WILL DROP ALL RECORDS AND START YOUR DB FROM SCRATCH
@@ -28,18 +59,48 @@ CORS(app)
 '''
 
 
+'''
+    GET /drinks?ingredient=<name>
+        only the drinks whose recipe uses the ingredient, found through the
+        ingredient table's (name, drink_id) index
+        the name is matched case-insensitively
+'''
+
+
 @app.route('/drinks')
 def drinks():
-    try:
-        drinks = [drink.short() for drink in Drink.query.all()]
-        return jsonify(
-            {
-                'success': True,
-                'drinks': drinks,
-            })
-    except KeyError:
-        print(os.sys.exc_info())
-        abort(422)
+    ingredient = request.args.get('ingredient')
+    if ingredient is None:
+        snapshot = menu.current()
+        body, etag = snapshot.short_body, snapshot.short_etag
+    else:
+        # searches aren't kept, but can still be revalidated
+        drink_ids = db.session.query(Ingredient.drink_id).filter(
+            Ingredient.name == Ingredient.normalize(ingredient))
+        drinks = Drink.query.filter(Drink.id.in_(drink_ids)).order_by(Drink.id).all()
+        body, etag = encode_drinks([drink.short() for drink in drinks])
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['DRINKS_MAX_AGE']
+    return response.make_conditional(request)
+
+
+'''
+    GET /drinks/stream
+        menu changes as server-sent events, served by src/menu_stream.py
+        when that runs behind the same address
+        this app answers 204 No Content, which stops EventSource clients
+        from reconnecting; they keep polling GET /drinks with its ETag
+'''
+
+
+@app.route('/drinks/stream')
+def drinks_stream():
+    response = Response(status=204)
+    response.headers['Link'] = '</drinks>; rel="alternate"'
+    return response
 
 
 '''
@@ -56,15 +117,12 @@ def drinks():
 @app.route('/drinks-detail')
 @requires_auth('get:drinks-detail')
 def drinks_detail(jwt):
-    try:
-        drinks = [drink.long() for drink in Drink.query.all()]
-        return jsonify(
-            {
-                'success': True,
-                'drinks': drinks,
-            })
-    except KeyError:
-        abort(422)
+    snapshot = menu.current()
+    response = Response(snapshot.long_body, mimetype='application/json')
+    response.set_etag(snapshot.long_etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 '''
@@ -97,8 +155,9 @@ def drinks_create(jwt):
 
     try:
         # create new drink
-        new_drink = Drink(title=drink_title, recipe=json.dumps(drink_recipe))
+        new_drink = Drink(title=drink_title, recipe=drink_recipe)
         new_drink.insert()
+        menu.publish()
 
         return jsonify(
             {
@@ -144,8 +203,9 @@ def drinks_patch(jwt, drink_id):
         if drink_title is not None:
             drink.title = drink_title
         if drink_recipe is not None:
-            drink.recipe = json.dumps(drink_recipe)
+            drink.recipe = drink_recipe
         drink.update()
+        menu.publish()
         return jsonify({
             'success': True,
             'drinks': [drink.long()],
@@ -177,6 +237,7 @@ def drinks_delete(jwt, drink_id):
 
     try:
         drink.delete()
+        menu.publish()
         return jsonify({
             'success': True,
             'delete': drink_id,
@@ -186,6 +247,201 @@ def drinks_delete(jwt, drink_id):
         abort(422)
 
 
+'''
+    POST /drinks/batch
+        applies a list of drink changes in one transaction, e.g.
+            {"operations": [
+                {"op": "create", "title": "Latte", "recipe": [...]},
+                {"op": "update", "id": 3, "recipe": [...]},
+                {"op": "delete", "id": 4}]}
+        the token is verified once, and each operation needs the permission
+        of its single-drink endpoint (post:drinks, patch:drinks, delete:drinks)
+        returns status code 200 and json {"success": True, "results": results}
+        with one result per operation, in order
+        if an operation is not permitted or fails nothing is applied: the
+        response has the status of the failure, and the results mark the
+        failed operations and skip the others
+'''
+BATCH_PERMISSIONS = {
+    'create': 'post:drinks',
+    'update': 'patch:drinks',
+    'delete': 'delete:drinks',
+}
+
+
+class BatchItemError(Exception):
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.message = message
+
+
+def apply_batch_operation(operation):
+    if operation['op'] == 'create':
+        if operation.get('title') is None or operation.get('recipe') is None:
+            raise BatchItemError(400, 'Bad request')
+        drink = Drink(title=operation['title'], recipe=operation['recipe'])
+        drink.insert(commit=False)
+        return {'drinks': [drink.long()]}
+
+    drink = Drink.query.filter(Drink.id == operation['id']).one_or_none()
+    if drink is None:
+        raise BatchItemError(404, 'Resource not found')
+    if operation['op'] == 'delete':
+        drink.delete(commit=False)
+        return {'delete': drink.id}
+    if operation.get('title') is not None:
+        drink.title = operation['title']
+    if operation.get('recipe') is not None:
+        drink.recipe = operation['recipe']
+    drink.update(commit=False)
+    return {'drinks': [drink.long()]}
+
+
+'''
+valid_batch_operation(operation)
+    whether an operation has the shape apply_batch_operation expects: an
+    object with a known op and, to update or delete, an integer id
+'''
+def valid_batch_operation(operation):
+    if not isinstance(operation, dict):
+        return False
+    op = operation.get('op')
+    if not isinstance(op, str) or op not in BATCH_PERMISSIONS:
+        return False
+    # bool is an int subclass, hence type() rather than isinstance()
+    return op == 'create' or type(operation.get('id')) is int
+
+
+def batch_failed(failures, count, status_code, message):
+    return jsonify({
+        'success': False,
+        'error': status_code,
+        'message': message,
+        'results': [failures.get(index, {'success': False, 'skipped': True}) for index in range(count)],
+    }), status_code
+
+
+@app.route('/drinks/batch', methods=['POST'])
+@requires_auth()
+def drinks_batch(jwt):
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+    operations = body.get('operations')
+    if not isinstance(operations, list) or not operations:
+        abort(400)
+    if not all(valid_batch_operation(operation) for operation in operations):
+        abort(400)
+
+    # every permission is checked before the database is touched
+    forbidden = {}
+    for index, operation in enumerate(operations):
+        try:
+            check_permissions(BATCH_PERMISSIONS[operation['op']], jwt)
+        except AuthError as error:
+            forbidden[index] = {'success': False, 'error': error.status_code, 'message': error.error}
+    if forbidden:
+        status_code = next(iter(forbidden.values()))['error']
+        return batch_failed(forbidden, len(operations), status_code, 'Forbidden')
+
+    results = []
+    for index, operation in enumerate(operations):
+        try:
+            results.append(dict(apply_batch_operation(operation), success=True))
+        except (KeyError, TypeError, IntegrityError):
+            error = BatchItemError(422, 'Unprocessable')
+        except RecipeError as recipe_error:
+            error = BatchItemError(422, str(recipe_error))
+        except BatchItemError as item_error:
+            error = item_error
+        else:
+            continue
+        db.session.rollback()
+        failure = {'success': False, 'error': error.status_code, 'message': error.message}
+        return batch_failed({index: failure}, len(operations), error.status_code, error.message)
+
+    db.session.commit()
+    menu.publish()
+    return jsonify({
+        'success': True,
+        'results': results,
+    })
+
+
+'''
+    GET /inventory/forecast
+        it should require the 'get:drinks-detail' permission
+        when each counted ingredient runs out, at the rate orders used it
+        over the last INVENTORY_FORECAST_WINDOW seconds
+        returns status code 200 and json {"success": True, "ingredients": ingredients}
+        where ingredients is a list of
+            {"name", "counted", "counted_at", "remaining", "per_hour", "depletes_at", "stale"}
+        in recipe parts, those running out first first; depletes_at is null
+        for ingredients not being used
+        only the orders of the last INVENTORY_COUNT_MAX_AGE seconds are read;
+        an ingredient counted before that is marked stale, and its remaining
+        quantity leaves out what older orders used
+'''
+
+
+@app.route('/inventory/forecast')
+@requires_auth('get:drinks-detail')
+def inventory_forecast(jwt):
+    now = time.time()
+    window = app.config['INVENTORY_FORECAST_WINDOW']
+    max_age = app.config['INVENTORY_COUNT_MAX_AGE']
+    matrix = compiled_menu(menu.version(), lambda: db.session.query(
+        Ingredient.drink_id, Ingredient.name, Ingredient.parts).all())
+    stock = db.session.query(Stock.name, Stock.quantity, Stock.counted_at).order_by(Stock.name).all()
+    since = forecast_since(stock, now, window, max_age)
+    orders = db.session.query(Order.created_at, Order.drinks).filter(Order.created_at >= since)
+    return jsonify({
+        'success': True,
+        'window': window,
+        'ingredients': forecast(matrix, stock, orders, now, window, max_age),
+    })
+
+
+'''
+    flask stock <name> <quantity>
+        records a count of an ingredient, in recipe parts, for the forecast
+'''
+
+
+@app.cli.command('stock')
+@click.argument('name')
+@click.argument('quantity', type=float)
+def stock_count(name, quantity):
+    Stock.__table__.create(db.engine, checkfirst=True)
+    db.session.merge(Stock(name=Ingredient.normalize(name), quantity=quantity, counted_at=time.time()))
+    db.session.commit()
+
+
+'''
+    flask index-ingredients
+        creates any missing tables, stores every drink's recipe in canonical
+        form and rebuilds the ingredient table from it, for databases
+        created before these existed
+        drinks whose recipe is invalid are listed and left as they are
+'''
+
+
+@app.cli.command('index-ingredients')
+def index_ingredients():
+    db.create_all()
+    drinks = Drink.query.all()
+    for drink in drinks:
+        try:
+            drink.recipe = drink.recipe
+        except RecipeError as error:
+            print('drink {}: {}'.format(drink.id, error))
+            continue
+        drink.index_ingredients()
+    db.session.commit()
+    menu.publish()
+    print('indexed the ingredients of {} drinks'.format(len(drinks)))
+
+
 # Error Handling
 @app.errorhandler(400)
 def bad_request(error):
@@ -247,6 +503,16 @@ def unprocessable(error):
         }), 422
 
 
+@app.errorhandler(RecipeError)
+def invalid_recipe(error):
+    return jsonify(
+        {
+            "success": False,
+            "error": 422,
+            "message": str(error)
+        }), 422
+
+
 @app.errorhandler(500)
 def server_error(error):
     return jsonify(
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+
+'''
+MenuSnapshot
+    the menu at one version, never modified once built: the drinks as
+    frozen records, and the GET /drinks and /drinks-detail bodies already
+    encoded, with their ETags
+'''
+RecipeItem = namedtuple('RecipeItem', 'name color parts')
+DrinkRecord = namedtuple('DrinkRecord', 'id title recipe')
+MenuSnapshot = namedtuple('MenuSnapshot', 'version drinks short_body short_etag long_body long_etag')
+
+
+def encode_drinks(drinks):
+    body = json.dumps({'success': True, 'drinks': drinks}).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()
+
+
+def build_snapshot(version, shorts, longs):
+    short_body, short_etag = encode_drinks(shorts)
+    long_body, long_etag = encode_drinks(longs)
+    drinks = tuple(DrinkRecord(drink['id'], drink['title'],
+                               tuple(RecipeItem(item['name'], item['color'], item['parts'])
+                                     for item in drink['recipe']))
+                   for drink in longs)
+    return MenuSnapshot(version, drinks, short_body, short_etag, long_body, long_etag)
+
+
+'''
+MenuSnapshots
+    holds the current MenuSnapshot
+
+    Reading it takes no lock: a new snapshot is built aside and replaces
+    the reference in one assignment. The version lives in a small file next
+    to the database, so a publish() from any worker process makes the
+    snapshots of all of them stale, and checking it is a stat() rather than
+    a database query. The latest snapshot is also written to disk, so a
+    restarted worker serves the menu without querying the database, as
+    long as the version hasn't changed since.
+
+    load() returns the menu from the database as (shorts, longs) lists.
+'''
+class MenuSnapshots:
+    def __init__(self, version_path, snapshot_path, load):
+        self.version_path = version_path
+        self.snapshot_path = snapshot_path
+        self.load = load
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def version(self):
+        try:
+            stat = os.stat(self.version_path)
+        except FileNotFoundError:
+            return None
+        # publish() replaces the file, so the inode changes even when the
+        # filesystem's mtime is too coarse to
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    '''
+    current()
+        the snapshot of the current version, built from the file on disk
+        or the database only when the one held is stale
+    '''
+    def current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version():
+            return snapshot
+        return self._refresh()
+
+    '''
+    publish()
+        makes a new version of the menu current, in this and every other
+        process; call it after the change has been committed
+    '''
+    def publish(self):
+        directory = os.path.dirname(self.version_path)
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            f.write(str(os.getpid()))
+        os.replace(f.name, self.version_path)
+        return self._refresh()
+
+    def _refresh(self):
+        with self._lock:
+            version = self.version()
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            snapshot = self._read(version)
+            if snapshot is None:
+                shorts, longs = self.load()
+                snapshot = build_snapshot(version, shorts, longs)
+                self.builds += 1
+                # a snapshot built from data older than the current version is
+                # still served once, but not kept
+                if self.version() != version:
+                    return snapshot
+                self._write(snapshot, shorts, longs)
+            self._snapshot = snapshot
+            return snapshot
+
+    def _read(self, version):
+        if version is None:
+            return None
+        try:
+            with open(self.snapshot_path) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if saved.get('version') != list(version):
+            return None
+        return build_snapshot(version, saved['short'], saved['long'])
+
+    def _write(self, snapshot, shorts, longs):
+        if snapshot.version is None:
+            return
+        directory = os.path.dirname(self.snapshot_path)
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+            json.dump({'version': list(snapshot.version), 'short': shorts, 'long': longs}, f)
+        os.replace(f.name, self.snapshot_path)
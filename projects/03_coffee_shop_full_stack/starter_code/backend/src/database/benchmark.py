@@ -0,0 +1,132 @@
+'''
+SQLite read/write concurrency benchmark
+
+    python -m src.database.benchmark [--processes 4] [--threads 4] [--seconds 5]
+
+Runs the same mixed workload (mostly menu reads, some drink updates)
+from several processes, each with several threads, against a scratch
+database: once with a default engine and once with the engine profile
+setup_db() applies. Reports operations per second, 99th percentile read
+latency, and how many operations failed with "database is locked".
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from .models import SQLITE_ENGINE_OPTIONS, set_sqlite_pragmas
+
+DRINKS = 50
+RECIPE = json.dumps([{'name': 'milk', 'color': 'grey', 'parts': 1}, {'name': 'coffee', 'color': 'brown', 'parts': 3}])
+
+
+def make_engine(path, profile):
+    if not profile:
+        return create_engine('sqlite:///' + path, connect_args={'check_same_thread': False})
+    engine = create_engine('sqlite:///' + path, **SQLITE_ENGINE_OPTIONS)
+    event.listen(engine, 'connect', set_sqlite_pragmas)
+    return engine
+
+
+def create_database(path, profile):
+    engine = make_engine(path, profile)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE drink (id INTEGER PRIMARY KEY, title VARCHAR(80) UNIQUE, '
+                                'recipe VARCHAR NOT NULL)'))
+        for n in range(DRINKS):
+            connection.execute(text('INSERT INTO drink (title, recipe) VALUES (:title, :recipe)'),
+                               {'title': 'drink {}'.format(n), 'recipe': RECIPE})
+    engine.dispose()
+
+
+def run_threads(path, profile, threads, seconds, write_ratio, results):
+    engine = make_engine(path, profile)
+    counts = {'reads': 0, 'writes': 0, 'locked': 0, 'read_latencies': []}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def work():
+        local = {'reads': 0, 'writes': 0, 'locked': 0, 'read_latencies': []}
+        rng = random.Random()
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    with engine.begin() as connection:
+                        connection.execute(text('UPDATE drink SET recipe = :recipe WHERE id = :id'),
+                                           {'recipe': RECIPE, 'id': rng.randint(1, DRINKS)})
+                    local['writes'] += 1
+                else:
+                    with engine.connect() as connection:
+                        rows = connection.execute(text('SELECT id, title, recipe FROM drink')).fetchall()
+                        [json.loads(row[2]) for row in rows]
+                    local['reads'] += 1
+                    local['read_latencies'].append(time.perf_counter() - started)
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+                local['locked'] += 1
+        with lock:
+            for key in counts:
+                counts[key] += local[key]
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    engine.dispose()
+    results.put(counts)
+
+
+def run(profile, processes, threads, seconds, write_ratio):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'benchmark.db')
+    create_database(path, profile)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_threads,
+                                       args=(path, profile, threads, seconds, write_ratio, results))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    totals = {'reads': 0, 'writes': 0, 'locked': 0, 'read_latencies': []}
+    for _ in workers:
+        counts = results.get()
+        for key in totals:
+            totals[key] += counts[key]
+    for worker in workers:
+        worker.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    print('{} processes x {} threads, {:.0%} writes, {}s each'.format(
+        args.processes, args.threads, args.write_ratio, args.seconds))
+    print('{:<10} {:>10} {:>10} {:>12} {:>10} {:>8}'.format(
+        'engine', 'reads/s', 'writes/s', 'read p99 ms', 'locked', 'locked%'))
+    for name, profile in (('default', False), ('profile', True)):
+        totals = run(profile, args.processes, args.threads, args.seconds, args.write_ratio)
+        attempts = totals['reads'] + totals['writes'] + totals['locked']
+        latencies = sorted(totals['read_latencies'])
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        print('{:<10} {:>10.0f} {:>10.0f} {:>12.2f} {:>10} {:>7.1%}'.format(
+            name, totals['reads'] / args.seconds, totals['writes'] / args.seconds, p99, totals['locked'],
+            totals['locked'] / attempts if attempts else 0))
+
+
+if __name__ == '__main__':
+    main()
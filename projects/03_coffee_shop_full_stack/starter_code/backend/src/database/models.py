@@ -1,21 +1,68 @@
 import os
-from sqlalchemy import Column, String, Integer
+import sqlite3
+from sqlalchemy import Column, String, Integer, Float, JSON, ForeignKey, Index, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import relationship, validates
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from .recipes import canonical_recipe
+
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
-database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
+# where the database and the menu files live; the tests point it elsewhere
+data_dir = os.environ.get('DATABASE_DIR', project_dir)
+database_path = "sqlite:///{}".format(os.path.join(data_dir, database_filename))
 
 db = SQLAlchemy()
 
+'''
+SQLite engine profile
+    WAL lets readers run alongside the single writer instead of queueing
+    behind it, and busy_timeout makes a second writer wait for the lock
+    rather than fail with "database is locked". synchronous=NORMAL is
+    durable in WAL mode except for the last transactions on power loss.
+    Each pooled connection gets the pragmas once, when it is opened.
+'''
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+
+SQLITE_ENGINE_OPTIONS = {
+    'poolclass': QueuePool,
+    'pool_size': 8,
+    'max_overflow': 8,
+    'pool_timeout': 10,
+    # pooled connections are handed between request threads
+    'connect_args': {'check_same_thread': False, 'timeout': 5},
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA {}={}'.format(name, value))
+    cursor.close()
+
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
 '''
-def setup_db(app):
+def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", dict(SQLITE_ENGINE_OPTIONS))
+    if not event.contains(Engine, 'connect', set_sqlite_pragmas):
+        event.listen(Engine, 'connect', set_sqlite_pragmas)
     db.app = app
     db.init_app(app)
 
@@ -38,33 +85,60 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
-    # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    # the ingredients, stored as JSON and deserialized once when the row is loaded
+    # the required datatype is [{'color': string, 'name':string, 'parts':number}],
+    # checked and canonicalized on assignment, see recipes.py
+    recipe = Column(JSON, nullable=False)
+    # the recipe's ingredients as rows, for lookups by ingredient name
+    ingredients = relationship('Ingredient', cascade='all, delete-orphan')
+
+    @validates('recipe')
+    def validate_recipe(self, key, recipe):
+        return canonical_recipe(recipe)
 
     '''
     short()
         short form representation of the Drink model
+        built once and reused until the drink changes
     '''
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': short_recipe
-        }
+        projections = self._projections()
+        if 'short' not in projections:
+            projections['short'] = {
+                'id': self.id,
+                'title': self.title,
+                'recipe': [{'color': r['color'], 'parts': r['parts']} for r in self.recipe]
+            }
+        return projections['short']
 
     '''
     long()
         long form representation of the Drink model
+        built once and reused until the drink changes
     '''
     def long(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': json.loads(self.recipe)
-        }
+        projections = self._projections()
+        if 'long' not in projections:
+            projections['long'] = {
+                'id': self.id,
+                'title': self.title,
+                'recipe': self.recipe
+            }
+        return projections['long']
+
+    def _projections(self):
+        # reading an expired attribute reloads the row, and the reload
+        # forgets the projections, so it must happen before they are looked up
+        if inspect(self).expired_attributes:
+            self.recipe
+        # instances loaded from the database skip __init__
+        projections = self.__dict__.get('_cached_projections')
+        if projections is None:
+            projections = self._cached_projections = {}
+        return projections
+
+    def forget_projections(self):
+        self.__dict__.pop('_cached_projections', None)
 
     '''
     insert()
@@ -74,10 +148,12 @@ class Drink(db.Model):
         EXAMPLE
             drink = Drink(title=req_title, recipe=req_recipe)
             drink.insert()
+        with commit=False the change is only flushed, for the caller to commit
     '''
-    def insert(self):
+    def insert(self, commit=True):
+        self.index_ingredients()
         db.session.add(self)
-        db.session.commit()
+        self._save(commit, 'create')
 
     '''
     delete()
@@ -87,9 +163,9 @@ class Drink(db.Model):
             drink = Drink(title=req_title, recipe=req_recipe)
             drink.delete()
     '''
-    def delete(self):
+    def delete(self, commit=True):
         db.session.delete(self)
-        db.session.commit()
+        self._save(commit, 'delete')
 
     '''
     update()
@@ -100,8 +176,140 @@ class Drink(db.Model):
             drink.title = 'Black Coffee'
             drink.update()
     '''
-    def update(self):
-        db.session.commit()
+    def update(self, commit=True):
+        if inspect(self).attrs.recipe.history.has_changes():
+            self.index_ingredients()
+        self._save(commit, 'update')
+
+    def _save(self, commit, kind):
+        # the change is recorded in the same transaction, for src/menu_stream.py
+        db.session.flush()
+        event = MenuEvent(kind=kind, drink_id=self.id, drink=None if kind == 'delete' else self.short())
+        db.session.add(event)
+        db.session.flush()
+        MenuEvent.query.filter(MenuEvent.id <= event.id - MENU_EVENTS_KEPT).delete(synchronize_session=False)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+
+    '''
+    index_ingredients()
+        mirrors the recipe into the ingredient table
+        insert() and update() call it; delete() removes the rows with the drink
+    '''
+    def index_ingredients(self):
+        self.ingredients = [
+            Ingredient(name=Ingredient.normalize(r['name']), color=r.get('color'), parts=r.get('parts'))
+            for r in self.recipe
+        ]
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+Ingredient
+one ingredient of a drink's recipe, mirrored from Drink.recipe so that
+drinks can be found by ingredient with an index lookup
+'''
+class Ingredient(db.Model):
+    id = Column(Integer, primary_key=True)
+    # lower-cased, see normalize()
+    name = Column(String(80), nullable=False)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), nullable=False)
+    color = Column(String(30))
+    parts = Column(Float)
+
+    __table_args__ = (
+        Index('ix_ingredient_name_drink_id', 'name', 'drink_id'),
+        Index('ix_ingredient_drink_id', 'drink_id'),
+    )
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(str(name).split()).lower()
+
+
+'''
+Order
+a customer's order of one or more drinks, as last written by the
+order service (see src/orders.py), which keeps orders in flight in memory
+'''
+class Order(db.Model):
+    __tablename__ = 'orders'
+    # uuid4 hex, assigned when the order is placed
+    id = Column(String(32), primary_key=True)
+    # the ordered drink ids, e.g. [1, 1, 3]
+    drinks = Column(JSON, nullable=False)
+    # larger is prepared first
+    priority = Column(Integer, nullable=False, default=0)
+    # queued, preparing or ready
+    status = Column(String(16), nullable=False)
+    station = Column(Integer)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index('ix_orders_status', 'status'),
+    )
+
+    def format(self):
+        return {
+            'id': self.id,
+            'drinks': self.drinks,
+            'priority': self.priority,
+            'status': self.status,
+            'station': self.station,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+
+'''
+MenuEvent
+a change to the menu, as pushed to clients of the menu stream
+'''
+MENU_EVENTS_KEPT = 1000
+
+
+class MenuEvent(db.Model):
+    __tablename__ = 'menu_event'
+    id = Column(Integer, primary_key=True)
+    # create, update or delete
+    kind = Column(String(8), nullable=False)
+    drink_id = Column(Integer, nullable=False)
+    # the drink's short() after the change, null when deleted
+    drink = Column(JSON)
+
+
+'''
+Stock
+the quantity of an ingredient, in recipe parts, when it was last counted
+'''
+class Stock(db.Model):
+    # an ingredient name, normalized like Ingredient.name
+    name = Column(String(80), primary_key=True)
+    quantity = Column(Float, nullable=False)
+    counted_at = Column(Float, nullable=False)
+
+
+'''
+a drink's short() and long() are rebuilt after any change to it: an
+assigned title or recipe, or attributes expired (e.g. by a commit) or
+refreshed from the database
+'''
+@event.listens_for(Drink.title, 'set')
+@event.listens_for(Drink.recipe, 'set')
+def drink_changed(drink, value, oldvalue, initiator):
+    drink.forget_projections()
+
+
+@event.listens_for(Drink, 'expire')
+def drink_expired(drink, attrs):
+    drink.forget_projections()
+
+
+@event.listens_for(Drink, 'refresh')
+def drink_refreshed(drink, context, attrs):
+    drink.forget_projections()
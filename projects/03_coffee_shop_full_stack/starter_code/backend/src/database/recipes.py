@@ -0,0 +1,67 @@
+'''
+Recipe validation
+
+A recipe is a list of ingredients, each {'name': string, 'color': string,
+'parts': number}. Drink.recipe only accepts recipes that pass
+canonical_recipe(), and stores what it returns, so a stored recipe always
+has exactly these keys with values of these types.
+'''
+
+
+class RecipeError(ValueError):
+    pass
+
+
+'''
+compile_recipe_validator(max_ingredients, max_name, max_color, max_parts)
+    returns a function that checks a recipe against these limits and returns
+    it in canonical form, or raises RecipeError saying what is wrong
+    the limits are bound once, so checking a recipe is a few type and
+    length tests per ingredient
+
+    canonical form: a list (a single ingredient object is accepted too), each
+    ingredient with only name, color and parts, whitespace in the name and
+    color collapsed, the color lower-cased, and whole float parts as ints
+'''
+def compile_recipe_validator(max_ingredients, max_name, max_color, max_parts):
+    def text(value, field, index, limit):
+        if type(value) is not str:
+            raise RecipeError('ingredient {}: {} must be a string'.format(index, field))
+        value = ' '.join(value.split())
+        if not 0 < len(value) <= limit:
+            raise RecipeError('ingredient {}: {} must be 1 to {} characters'.format(index, field, limit))
+        return value
+
+    def canonical_recipe(recipe):
+        if type(recipe) is dict:
+            recipe = [recipe]
+        elif type(recipe) is not list:
+            raise RecipeError('recipe must be a list of ingredients')
+        if not 0 < len(recipe) <= max_ingredients:
+            raise RecipeError('recipe must have 1 to {} ingredients'.format(max_ingredients))
+
+        canonical = []
+        for index, ingredient in enumerate(recipe):
+            if type(ingredient) is not dict:
+                raise RecipeError('ingredient {}: must be an object'.format(index))
+            parts = ingredient.get('parts')
+            # bool is an int subclass, hence type() rather than isinstance()
+            if type(parts) is not int and type(parts) is not float:
+                raise RecipeError('ingredient {}: parts must be a number'.format(index))
+            # written so that NaN fails too
+            if not 0 < parts <= max_parts:
+                raise RecipeError('ingredient {}: parts must be more than 0 and at most {}'.format(
+                    index, max_parts))
+            if type(parts) is float and parts.is_integer():
+                parts = int(parts)
+            canonical.append({
+                'name': text(ingredient.get('name'), 'name', index, max_name),
+                'color': text(ingredient.get('color'), 'color', index, max_color).lower(),
+                'parts': parts,
+            })
+        return canonical
+
+    return canonical_recipe
+
+
+canonical_recipe = compile_recipe_validator(max_ingredients=20, max_name=80, max_color=30, max_parts=100)
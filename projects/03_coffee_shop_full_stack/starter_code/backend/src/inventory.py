@@ -0,0 +1,149 @@
+import threading
+from itertools import chain, repeat
+
+import numpy as np
+
+
+'''
+MenuMatrix
+    the menu compiled into a drinks x ingredients matrix of recipe parts
+
+    The ingredients used by any number of drinks are then one product:
+    count how often each drink was ordered, and multiply the counts by the
+    matrix. Rows are in order of drink id and columns in order of
+    ingredient name.
+'''
+class MenuMatrix:
+    def __init__(self, drink_ids, ingredients, parts):
+        self.drink_ids = drink_ids
+        self.ingredients = ingredients
+        self.parts = parts
+
+    '''
+    compile(rows)
+        builds the matrix from (drink id, ingredient name, parts) rows,
+        e.g. the ingredient table; parts of the same ingredient in one
+        drink are added up
+    '''
+    @classmethod
+    def compile(cls, rows):
+        rows = list(rows)
+        drink_ids, drink_rows = np.unique(np.array([row[0] for row in rows], dtype=np.int64),
+                                          return_inverse=True)
+        ingredients, ingredient_columns = np.unique(np.array([row[1] for row in rows], dtype=str),
+                                                    return_inverse=True)
+        parts = np.zeros((len(drink_ids), len(ingredients)))
+        np.add.at(parts, (drink_rows, ingredient_columns),
+                  np.array([row[2] or 0 for row in rows], dtype=np.float64))
+        return cls(drink_ids, tuple(ingredients.tolist()), parts)
+
+    '''
+    counts(drink_ids)
+        how many times each drink of the matrix appears in drink_ids,
+        ignoring drinks no longer on the menu
+    '''
+    def counts(self, drink_ids):
+        drink_ids = np.asarray(drink_ids, dtype=np.int64)
+        if not len(self.drink_ids):
+            return np.zeros(0)
+        rows = np.minimum(np.searchsorted(self.drink_ids, drink_ids), len(self.drink_ids) - 1)
+        rows = rows[self.drink_ids[rows] == drink_ids]
+        return np.bincount(rows, minlength=len(self.drink_ids)).astype(np.float64)
+
+    '''
+    consumption(drink_ids)
+        the parts of each ingredient used to make the drinks in drink_ids
+    '''
+    def consumption(self, drink_ids):
+        return self.counts(drink_ids) @ self.parts
+
+
+'''
+compiled_menu(version, rows)
+    the MenuMatrix for a menu version, compiled from rows() only when the
+    version differs from the last one compiled
+'''
+_compiled = {'version': None, 'matrix': None}
+_compiled_lock = threading.Lock()
+
+
+def compiled_menu(version, rows):
+    with _compiled_lock:
+        if _compiled['matrix'] is None or _compiled['version'] != version:
+            _compiled['matrix'] = MenuMatrix.compile(rows())
+            _compiled['version'] = version
+        return _compiled['matrix']
+
+
+'''
+ordered_drinks(orders)
+    flattens (created_at, [drink ids]) orders into two arrays with one
+    entry per drink: when it was ordered and its id
+'''
+def ordered_drinks(orders):
+    orders = list(orders)
+    count = sum(len(drinks) for _, drinks in orders)
+    times = np.fromiter(chain.from_iterable(repeat(created_at, len(drinks)) for created_at, drinks in orders),
+                        dtype=np.float64, count=count)
+    drinks = np.fromiter(chain.from_iterable(drinks for _, drinks in orders), dtype=np.int64, count=count)
+    return times, drinks
+
+
+'''
+forecast_since(stock, now, window, max_age)
+    the time from which forecast() needs the orders: the earliest count or
+    the start of the window, but no more than max_age seconds ago
+'''
+def forecast_since(stock, now, window, max_age):
+    return max(min([now - window] + [counted_at for _, _, counted_at in stock]), now - max_age)
+
+
+'''
+forecast(matrix, stock, orders, now, window, max_age)
+    when each counted ingredient runs out at the rate of the last window
+    seconds of orders
+        stock: (name, quantity, counted_at) rows
+        orders: (created_at, [drink ids]), at least those since
+            forecast_since()
+    what remains is the counted quantity less what the orders placed since
+    the count used
+    a count older than max_age seconds is only charged for the orders of
+    the last max_age seconds, so the orders read stay bounded however old
+    the counts get; its result says stale, and the ingredient should be
+    counted again
+    returns one dict per ingredient, those running out first first
+'''
+def forecast(matrix, stock, orders, now, window, max_age):
+    times, drinks = ordered_drinks(orders)
+    columns = {name: column for column, name in enumerate(matrix.ingredients)}
+    # ingredients not on the menu point at an extra column that stays 0
+    stock_columns = np.array([columns.get(name, len(columns)) for name, _, _ in stock], dtype=np.int64)
+    quantities = np.array([quantity for _, quantity, _ in stock], dtype=np.float64)
+    counted_at = np.array([counted for _, _, counted in stock], dtype=np.float64)
+    stale = counted_at < now - max_age
+    charged_from = np.maximum(counted_at, now - max_age)
+
+    def used_since(since):
+        return np.append(matrix.consumption(drinks[times >= since]), 0.0)[stock_columns]
+
+    rates = used_since(now - window) / window
+    used = np.zeros(len(stock))
+    # stock is usually counted all at once, so this is one product
+    for counted in np.unique(charged_from):
+        counted_together = charged_from == counted
+        used[counted_together] = used_since(counted)[counted_together]
+    remaining = np.maximum(quantities - used, 0.0)
+    with np.errstate(divide='ignore'):
+        seconds_left = np.where(rates > 0, remaining / rates, np.inf)
+
+    results = [{
+        'name': name,
+        'counted': float(quantities[i]),
+        'counted_at': float(counted_at[i]),
+        'remaining': float(remaining[i]),
+        'per_hour': float(rates[i] * 3600),
+        'depletes_at': float(now + seconds_left[i]) if np.isfinite(seconds_left[i]) else None,
+        'stale': bool(stale[i]),
+    } for i, (name, _, _) in enumerate(stock)]
+    results.sort(key=lambda result: (result['depletes_at'] is None, result['depletes_at'] or 0, result['name']))
+    return results
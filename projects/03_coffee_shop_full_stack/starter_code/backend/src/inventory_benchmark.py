@@ -0,0 +1,86 @@
+'''
+Ingredient consumption benchmark
+
+    python -m src.inventory_benchmark [--drinks 10000] [--orders 100000] [--ingredients 100]
+
+Computes how much of each ingredient a batch of orders uses, for a random
+menu, twice: by looping over the parsed recipes of every ordered drink,
+and with MenuMatrix (compiling the menu, then one product). Checks that
+both agree and reports the time each took.
+'''
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from .inventory import MenuMatrix, ordered_drinks
+
+
+def make_menu(drinks, ingredients, rng):
+    names = ['ingredient {}'.format(n) for n in range(ingredients)]
+    return {
+        drink_id: json.dumps([{'name': name, 'color': 'brown', 'parts': rng.randint(1, 4)}
+                              for name in rng.sample(names, rng.randint(2, 5))])
+        for drink_id in range(1, drinks + 1)
+    }
+
+
+def make_orders(orders, drinks, rng):
+    now = time.time()
+    return [(now - rng.random() * 3600, [rng.randint(1, drinks) for _ in range(rng.randint(1, 4))])
+            for _ in range(orders)]
+
+
+def consumption_loop(menu, orders):
+    recipes = {drink_id: json.loads(recipe) for drink_id, recipe in menu.items()}
+    used = {}
+    for _, drinks in orders:
+        for drink_id in drinks:
+            for ingredient in recipes[drink_id]:
+                used[ingredient['name']] = used.get(ingredient['name'], 0) + ingredient['parts']
+    return used
+
+
+def consumption_matrix(menu, orders):
+    matrix = MenuMatrix.compile((drink_id, ingredient['name'], ingredient['parts'])
+                                for drink_id, recipe in menu.items() for ingredient in json.loads(recipe))
+    compiled = time.perf_counter()
+    _, drinks = ordered_drinks(orders)
+    flattened = time.perf_counter()
+    return matrix, matrix.consumption(drinks), compiled, flattened
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drinks', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--ingredients', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    menu = make_menu(args.drinks, args.ingredients, rng)
+    orders = make_orders(args.orders, args.drinks, rng)
+
+    started = time.perf_counter()
+    used = consumption_loop(menu, orders)
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matrix, consumed, compiled, flattened = consumption_matrix(menu, orders)
+    finished = time.perf_counter()
+
+    expected = np.array([used.get(name, 0) for name in matrix.ingredients], dtype=np.float64)
+    if not np.allclose(consumed, expected):
+        raise SystemExit('the matrix and the loop disagree')
+
+    print('{} drinks x {} ingredients, {} orders'.format(args.drinks, args.ingredients, args.orders))
+    print('{:<28} {:>10.1f} ms'.format('loop over parsed recipes', loop_seconds * 1000))
+    print('{:<28} {:>10.1f} ms'.format('matrix: compile menu', (compiled - started) * 1000))
+    print('{:<28} {:>10.1f} ms'.format('matrix: flatten orders', (flattened - compiled) * 1000))
+    print('{:<28} {:>10.1f} ms'.format('matrix: consumption', (finished - flattened) * 1000))
+
+
+if __name__ == '__main__':
+    main()
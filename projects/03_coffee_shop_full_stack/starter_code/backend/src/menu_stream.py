@@ -0,0 +1,215 @@
+'''
+Menu change stream
+
+    python -m src.menu_stream [--host 127.0.0.1] [--port 5001]
+
+Serves GET /drinks/stream as server-sent events: one event per drink
+created, updated or deleted, with the drink's short() form. Route
+/drinks/stream to this process; the Flask app answers it with 204 No
+Content, which tells EventSource clients not to reconnect, so without
+this server they keep polling GET /drinks with If-None-Match instead.
+
+It runs on asyncio, so an idle subscriber costs a coroutine rather than a
+worker thread. It learns about changes from the menu version file the API
+bumps after each commit, and reads them from the menu_event table the
+Drink model writes in the same transaction.
+
+    id: 42
+    event: update
+    data: {"id": 3, "drink": {"id": 3, "title": "...", "recipe": [...]}}
+
+A client that reconnects with Last-Event-ID gets the events it missed.
+When they are no longer known, or on a first connection, it gets a reset
+event instead and should revalidate its menu with GET /drinks.
+'''
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sqlite3
+from urllib.parse import parse_qs, urlsplit
+
+from .database.models import data_dir, database_filename
+
+# seconds between checks of the menu version file
+POLL_INTERVAL = 0.5
+# seconds without an event before a keepalive comment
+KEEPALIVE = 15
+# events kept for reconnecting clients
+BACKLOG = 1000
+# events waiting for a slow client before it is disconnected
+QUEUE_SIZE = 100
+
+HEADERS = (b'HTTP/1.1 200 OK\r\n'
+           b'Content-Type: text/event-stream\r\n'
+           b'Cache-Control: no-cache\r\n'
+           b'Access-Control-Allow-Origin: *\r\n'
+           b'X-Accel-Buffering: no\r\n'
+           b'\r\n'
+           b'retry: 5000\n\n')
+NOT_FOUND = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+RESET = b'event: reset\ndata: {"url": "/drinks"}\n\n'
+
+
+class MenuStream:
+    def __init__(self, database_path, version_path, poll_interval=POLL_INTERVAL):
+        self.database_path = database_path
+        self.version_path = version_path
+        self.poll_interval = poll_interval
+        self.backlog = collections.deque(maxlen=BACKLOG)
+        self.last_id = 0
+        # subscriber queue -> its connection
+        self.subscribers = {}
+
+    def _version(self):
+        try:
+            stat = os.stat(self.version_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _query(self, sql, parameters=()):
+        connection = sqlite3.connect('file:{}?mode=ro'.format(self.database_path), uri=True)
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        except sqlite3.OperationalError:
+            # no menu_event table yet
+            return []
+        finally:
+            connection.close()
+
+    def _events_after(self, event_id):
+        return self._query('SELECT id, kind, drink_id, drink FROM menu_event WHERE id > ? ORDER BY id',
+                           (event_id,))
+
+    @staticmethod
+    def _message(event_id, kind, drink_id, drink):
+        data = json.dumps({'id': drink_id, 'drink': json.loads(drink) if drink else None})
+        return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, kind, data).encode('utf-8')
+
+    '''
+    poll()
+        runs for ever, publishing the new events each time the menu version
+        changes
+    '''
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        version = self._version()
+        self.last_id = await loop.run_in_executor(None, self._latest_id)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = self._version()
+            if current == version:
+                continue
+            version = current
+            await self.catch_up()
+
+    '''
+    catch_up()
+        publishes the events after the last one published
+        when the table's ids went backwards, as they do when the database
+        is recreated, the events known so far are forgotten and every
+        subscriber gets a reset event
+    '''
+    async def catch_up(self):
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, self._latest_id) < self.last_id:
+            self.restart()
+        for event in await loop.run_in_executor(None, self._events_after, self.last_id):
+            self.publish(event[0], self._message(*event))
+
+    def _latest_id(self):
+        rows = self._query('SELECT max(id) FROM menu_event')
+        return (rows[0][0] if rows else None) or 0
+
+    def restart(self):
+        self.last_id = 0
+        self.backlog.clear()
+        self._broadcast(RESET)
+
+    def publish(self, event_id, message):
+        self.last_id = event_id
+        self.backlog.append((event_id, message))
+        self._broadcast(message)
+
+    def _broadcast(self, message):
+        for queue, writer in list(self.subscribers.items()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                del self.subscribers[queue]
+                writer.close()
+
+    '''
+    missed(last_event_id)
+        the messages after last_event_id, or None if they aren't all known
+    '''
+    def missed(self, last_event_id):
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            return None
+        if last_event_id == self.last_id:
+            return []
+        if not self.backlog or not self.backlog[0][0] - 1 <= last_event_id < self.last_id:
+            return None
+        return [message for event_id, message in self.backlog if event_id > last_event_id]
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            lines = request.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        if method != 'GET' or url.path != '/drinks/stream':
+            writer.write(NOT_FOUND)
+            writer.close()
+            return
+
+        last_event_id = headers.get('last-event-id') or parse_qs(url.query).get('last_event_id', [None])[0]
+        queue = asyncio.Queue(QUEUE_SIZE)
+        # subscribing and replaying happen without yielding, so no event
+        # is both missed and queued, or neither
+        self.subscribers[queue] = writer
+        missed = self.missed(last_event_id)
+        writer.write(HEADERS)
+        writer.writelines([RESET] if missed is None else missed)
+        try:
+            while queue in self.subscribers:
+                try:
+                    message = await asyncio.wait_for(queue.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+                writer.write(message)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.pop(queue, None)
+            writer.close()
+
+
+async def serve(host, port):
+    stream = MenuStream(os.path.join(data_dir, database_filename), os.path.join(data_dir, 'menu.version'))
+    server = await asyncio.start_server(stream.handle, host, port)
+    await asyncio.gather(server.serve_forever(), stream.poll())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+import atexit
+import heapq
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from sqlalchemy import bindparam
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .database.models import db, Drink, Order
+
+
+'''
+Orders
+    Orders are queued and prepared in this process: a priority queue feeds
+    a pool of station threads, and every status change is pushed to the
+    clients following the order over server-sent events.
+
+    Orders in flight live in memory. The database is written by a single
+    writer thread that commits the changes of many orders at once, so
+    placing an order doesn't wait for a commit. A write that fails is
+    retried until it succeeds. An order accepted in the last
+    ORDER_COMMIT_INTERVAL seconds before a crash, or while the database is
+    unreachable, can be lost; orders that were written but not ready are
+    queued again on the next start.
+
+    Run a single worker process: the queue is not shared between processes.
+'''
+
+orders = Blueprint('orders', __name__)
+
+
+'''
+OrderQueue
+    orders by descending priority, first come first served within one
+'''
+class OrderQueue:
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._changed = threading.Condition()
+        self.closed = False
+
+    def __len__(self):
+        with self._changed:
+            return len(self._heap)
+
+    def put(self, order):
+        with self._changed:
+            heapq.heappush(self._heap, (-order['priority'], next(self._sequence), order))
+            self._changed.notify()
+
+    '''
+    claim()
+        removes and returns the next order, waiting for one if the queue is
+        empty; returns None once the queue is closed
+    '''
+    def claim(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self._heap or self.closed)
+            if self.closed:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+
+'''
+OrderWriter
+    writes new orders and status changes from a background thread, in one
+    transaction per batch: whatever arrived within interval seconds of the
+    first change, up to batch_size changes
+
+    A batch the database refuses (it is down, locked, ...) is written again
+    after backoff seconds, doubling up to max_backoff, for as long as it
+    takes: its orders were already accepted. Only while stopping does it
+    give up, after stop_attempts. A batch with a row the database rejects
+    is written one change at a time, so only that change is lost.
+'''
+class OrderWriter:
+    def __init__(self, app, interval, batch_size, backoff=0.05, max_backoff=5, stop_attempts=3):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stop_attempts = stop_attempts
+        self._changes = queue.Queue()
+        self._thread = None
+        self._stopping = False
+        self.commits = 0
+        self.written = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+        self._thread.start()
+
+    '''
+    stop()
+        writes the changes already submitted and stops the thread
+    '''
+    def stop(self):
+        self._stopping = True
+        self._changes.put(None)
+        self._thread.join()
+
+    def insert(self, order):
+        self._changes.put(('insert', order))
+
+    def update(self, order):
+        self._changes.put(('update', {
+            '_id': order['id'],
+            'status': order['status'],
+            'station': order['station'],
+            'updated_at': order['updated_at'],
+        }))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            change = self._changes.get()
+            if change is None:
+                break
+            batch = [change]
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    change = self._changes.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if change is None:
+                    stopping = True
+                    break
+                batch.append(change)
+            self._write(batch)
+
+    def _write(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self._execute(batch)
+            except (IntegrityError, DataError):
+                if len(batch) > 1:
+                    for change in batch:
+                        self._write([change])
+                    return
+                self.failed += 1
+                self.app.logger.exception('order change rejected: %r', batch[0])
+                return
+            except Exception:
+                attempt += 1
+                if self._stopping and attempt >= self.stop_attempts:
+                    self.failed += len(batch)
+                    self.app.logger.exception('could not write %d order changes, giving up', len(batch))
+                    return
+                self.retries += 1
+                self.app.logger.exception('could not write %d order changes, retrying', len(batch))
+                time.sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+                continue
+            self.commits += 1
+            self.written += len(batch)
+            return
+
+    def _execute(self, batch):
+        inserts = [row for kind, row in batch if kind == 'insert']
+        # only the last status of an order in the batch needs writing
+        updates = OrderedDict()
+        for kind, row in batch:
+            if kind == 'update':
+                updates[row['_id']] = row
+        table = Order.__table__
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                if inserts:
+                    connection.execute(table.insert(), inserts)
+                if updates:
+                    connection.execute(table.update().where(table.c.id == bindparam('_id')),
+                                       list(updates.values()))
+
+
+'''
+OrderService
+    places orders, runs the stations preparing them and tells listeners
+    about every status change
+'''
+class OrderService:
+    # orders kept in memory after they are ready, for late listeners
+    FINISHED_KEPT = 10000
+
+    def __init__(self, app):
+        self.app = app
+        self.stations = app.config['ORDER_STATIONS']
+        self.prepare_seconds = app.config['ORDER_PREPARE_SECONDS']
+        self.queue = OrderQueue()
+        self.writer = OrderWriter(app, app.config['ORDER_COMMIT_INTERVAL'], app.config['ORDER_COMMIT_BATCH'])
+        self._active = {}
+        self._finished = OrderedDict()
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.started = False
+
+    '''
+    start()
+        creates the orders table if needed, queues again the orders left
+        unfinished by the last run, and starts the writer and the stations
+        called on the first request that needs it, in an app context
+    '''
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+            Order.__table__.create(db.engine, checkfirst=True)
+            for row in Order.query.filter(Order.status != 'ready').order_by(Order.created_at):
+                order = dict(row.format(), status='queued', station=None)
+                self._active[order['id']] = order
+                self.queue.put(order)
+            self.writer.start()
+            for number in range(1, self.stations + 1):
+                thread = threading.Thread(target=self._station, args=(number,),
+                                          name='station-{}'.format(number), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        atexit.register(self.stop)
+
+    '''
+    stop()
+        stops the stations, leaving queued orders for the next start,
+        and writes the pending changes
+    '''
+    def stop(self):
+        with self._lock:
+            if not self.started:
+                return
+            self.started = False
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+        self.writer.stop()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._active)
+
+    def place(self, drink_ids, priority):
+        self.start()
+        now = time.time()
+        order = {
+            'id': uuid.uuid4().hex,
+            'drinks': drink_ids,
+            'priority': priority,
+            'status': 'queued',
+            'station': None,
+            'created_at': now,
+            'updated_at': now,
+        }
+        with self._lock:
+            self._active[order['id']] = order
+            snapshot = dict(order)
+        self.writer.insert(snapshot)
+        self.queue.put(order)
+        return snapshot
+
+    '''
+    get(order_id)
+        the order as a dict, from memory or else the database; None if unknown
+    '''
+    def get(self, order_id):
+        with self._lock:
+            order = self._active.get(order_id) or self._finished.get(order_id)
+            if order is not None:
+                return dict(order)
+        row = Order.query.get(order_id)
+        return row.format() if row else None
+
+    '''
+    subscribe(order_id)
+        returns (listener, order): the order as it is now, and a queue that
+        receives a copy of the order after each later change
+        listener is None when the order won't change any more
+    '''
+    def subscribe(self, order_id):
+        self.start()
+        with self._lock:
+            order = self._active.get(order_id)
+            if order is not None:
+                listener = queue.Queue()
+                self._listeners.setdefault(order_id, set()).add(listener)
+                return listener, dict(order)
+        return None, self.get(order_id)
+
+    def unsubscribe(self, order_id, listener):
+        with self._lock:
+            listeners = self._listeners.get(order_id)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[order_id]
+
+    def _set_status(self, order, status, station):
+        with self._lock:
+            order['status'] = status
+            order['station'] = station
+            order['updated_at'] = time.time()
+            snapshot = dict(order)
+            if status == 'ready':
+                del self._active[order['id']]
+                self._finished[order['id']] = snapshot
+                if len(self._finished) > self.FINISHED_KEPT:
+                    self._finished.popitem(last=False)
+            listeners = list(self._listeners.get(order['id'], ()))
+        self.writer.update(snapshot)
+        for listener in listeners:
+            listener.put(snapshot)
+
+    def _station(self, number):
+        while True:
+            order = self.queue.claim()
+            if order is None:
+                return
+            self._set_status(order, 'preparing', number)
+            time.sleep(self.prepare_seconds * len(order['drinks']))
+            self._set_status(order, 'ready', number)
+
+
+'''
+init_orders(app)
+    creates the app's order service and registers the order routes
+'''
+def init_orders(app):
+    app.config.setdefault('ORDER_STATIONS', 4)
+    app.config.setdefault('ORDER_PREPARE_SECONDS', 1.0)
+    app.config.setdefault('ORDER_COMMIT_INTERVAL', 0.05)
+    app.config.setdefault('ORDER_COMMIT_BATCH', 500)
+    app.config.setdefault('ORDER_MAX_DRINKS', 20)
+    app.config.setdefault('ORDER_KEEPALIVE', 15)
+    service = app.extensions['orders'] = OrderService(app)
+    app.register_blueprint(orders)
+    return service
+
+
+'''
+    POST /orders
+        it should be a public endpoint, like the menu
+        takes json {"drinks": [drink ids], "priority": 0}, priority being
+        0 to 9 and larger first
+        returns status code 202 and json {"success": True, "order": order}
+        or 400 for a malformed order and 422 for unknown drinks
+'''
+
+
+@orders.route('/orders', methods=['POST'])
+def orders_create():
+    body = request.get_json(silent=True) or {}
+    drink_ids = body.get('drinks')
+    priority = body.get('priority', 0)
+    if (not isinstance(drink_ids, list) or not drink_ids
+            or len(drink_ids) > current_app.config['ORDER_MAX_DRINKS']
+            or any(type(drink_id) is not int for drink_id in drink_ids)
+            or type(priority) is not int or not 0 <= priority <= 9):
+        abort(400)
+
+    known = {drink_id for (drink_id,) in db.session.query(Drink.id).filter(Drink.id.in_(set(drink_ids)))}
+    if known != set(drink_ids):
+        abort(422)
+
+    order = current_app.extensions['orders'].place(drink_ids, priority)
+    return jsonify({
+        'success': True,
+        'order': order,
+    }), 202
+
+
+'''
+    GET /orders/<id>
+        returns status code 200 and json {"success": True, "order": order}
+        or 404 if there is no such order
+'''
+
+
+@orders.route('/orders/<order_id>')
+def orders_get(order_id):
+    order = current_app.extensions['orders'].get(order_id)
+    if order is None:
+        abort(404)
+    return jsonify({
+        'success': True,
+        'order': order,
+    })
+
+
+'''
+    GET /orders/<id>/events
+        a text/event-stream of the order: the order as it is now, then again
+        after each status change, closed once it is ready
+        a comment is sent every ORDER_KEEPALIVE seconds without a change
+'''
+
+
+@orders.route('/orders/<order_id>/events')
+def orders_events(order_id):
+    service = current_app.extensions['orders']
+    keepalive = current_app.config['ORDER_KEEPALIVE']
+    listener, order = service.subscribe(order_id)
+    if order is None:
+        abort(404)
+
+    def events(order):
+        try:
+            yield 'data: {}\n\n'.format(json.dumps(order))
+            while listener is not None and order['status'] != 'ready':
+                try:
+                    order = listener.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'data: {}\n\n'.format(json.dumps(order))
+        finally:
+            if listener is not None:
+                service.unsubscribe(order_id, listener)
+
+    response = Response(stream_with_context(events(order)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # proxies such as nginx would otherwise hold the events back
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,104 @@
+'''
+Order load test
+
+    python -m src.orders_loadtest [--clients 16] [--seconds 10] [--stations 4]
+
+Places orders from several client threads through POST /orders for a
+while, against a scratch database, then waits for the stations to finish
+them and the writer to commit them. Reports orders placed per second, the
+99th percentile POST latency, orders completed per second, and how many
+commits the writer needed.
+'''
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from flask import Flask
+
+from .database.models import setup_db, db, Drink, Order
+from .orders import init_orders
+
+DRINKS = 20
+
+
+def make_app(path, stations, prepare_seconds):
+    app = Flask(__name__)
+    setup_db(app, 'sqlite:///' + path)
+    app.config['ORDER_STATIONS'] = stations
+    app.config['ORDER_PREPARE_SECONDS'] = prepare_seconds
+    init_orders(app)
+    with app.app_context():
+        db.create_all()
+        for n in range(DRINKS):
+            Drink(title='drink {}'.format(n), recipe=[{'name': 'coffee', 'color': 'brown', 'parts': 1}]).insert()
+    return app
+
+
+def place_orders(app, seconds, results):
+    client = app.test_client()
+    rng = random.Random()
+    latencies = []
+    failed = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        order = {
+            'drinks': [rng.randint(1, DRINKS) for _ in range(rng.randint(1, 4))],
+            'priority': rng.choice((0, 0, 0, 5)),
+        }
+        started = time.perf_counter()
+        response = client.post('/orders', json=order)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 202:
+            failed += 1
+    results.append((latencies, failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--stations', type=int, default=4)
+    parser.add_argument('--prepare-seconds', type=float, default=0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'orders.db')
+    app = make_app(path, args.stations, args.prepare_seconds)
+    service = app.extensions['orders']
+
+    results = []
+    clients = [threading.Thread(target=place_orders, args=(app, args.seconds, results))
+               for _ in range(args.clients)]
+    started = time.time()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    placed_in = time.time() - started
+
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    failed = sum(client_failed for _, client_failed in results)
+    placed = len(latencies) - failed
+    # stop() leaves queued orders alone, so wait for the stations first
+    while service.in_flight():
+        time.sleep(0.05)
+    service.stop()
+    finished_in = time.time() - started
+
+    with app.app_context():
+        ready = Order.query.filter(Order.status == 'ready').count()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    print('{} clients, {} stations, {}s per drink, {}s'.format(
+        args.clients, args.stations, args.prepare_seconds, args.seconds))
+    print('placed      {:>8} ({:.0f}/s, {} failed)'.format(placed, placed / placed_in, failed))
+    print('POST p99    {:>8.2f} ms'.format(p99))
+    print('ready       {:>8} ({:.0f}/s)'.format(ready, ready / finished_in))
+    print('commits     {:>8} ({:.0f} changes each, {} retried, {} failed)'.format(
+        service.writer.commits, service.writer.written / max(service.writer.commits, 1), service.writer.retries,
+        service.writer.failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,572 @@
+import os
+import unittest
+import asyncio
+import json
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+# the database and the menu files go to a scratch directory, set before
+# the app is imported since it is bound to the database on import
+os.environ['DATABASE_DIR'] = tempfile.mkdtemp()
+
+from src.api import app, menu
+from src.cache import MenuSnapshots
+from src.database.models import db, db_drop_and_create_all, Drink, Ingredient, Order
+from src.inventory import MenuMatrix, forecast, forecast_since
+from src.menu_stream import BACKLOG, RESET, MenuStream
+from src.orders import OrderWriter
+from src.database.recipes import RecipeError, canonical_recipe
+
+
+class RecipeValidatorTestCase(unittest.TestCase):
+    """This class represents the recipe validator test case"""
+
+    def setUp(self):
+        """Define test variables."""
+        self.ingredient = {'name': 'milk', 'color': 'grey', 'parts': 1}
+
+    def assertRejected(self, recipe, message):
+        with self.assertRaises(RecipeError) as context:
+            canonical_recipe(recipe)
+        self.assertEqual(str(context.exception), message)
+
+    def test_canonical_recipe(self):
+        recipe = canonical_recipe([
+            {'name': '  steamed \t milk ', 'color': 'Light  GREY', 'parts': 2.0, 'note': 'hot'},
+            {'name': 'espresso', 'color': 'brown', 'parts': 0.5},
+        ])
+
+        self.assertEqual(recipe, [
+            {'name': 'steamed milk', 'color': 'light grey', 'parts': 2},
+            {'name': 'espresso', 'color': 'brown', 'parts': 0.5},
+        ])
+        self.assertEqual(type(recipe[0]['parts']), int)
+
+    def test_single_ingredient_is_a_recipe(self):
+        self.assertEqual(canonical_recipe(self.ingredient), [self.ingredient])
+
+    def test_reject_recipe_not_a_list(self):
+        self.assertRejected('milk', 'recipe must be a list of ingredients')
+        self.assertRejected(None, 'recipe must be a list of ingredients')
+
+    def test_reject_recipe_size(self):
+        self.assertRejected([], 'recipe must have 1 to 20 ingredients')
+        self.assertRejected([self.ingredient] * 21, 'recipe must have 1 to 20 ingredients')
+
+    def test_reject_ingredient_not_an_object(self):
+        self.assertRejected([self.ingredient, ['milk']], 'ingredient 1: must be an object')
+
+    def test_reject_parts_not_a_number(self):
+        for parts in (True, False, '1', None, [1]):
+            self.assertRejected(dict(self.ingredient, parts=parts), 'ingredient 0: parts must be a number')
+
+    def test_reject_parts_out_of_range(self):
+        for parts in (0, -1, 100.5, float('nan'), float('inf')):
+            self.assertRejected(dict(self.ingredient, parts=parts),
+                                'ingredient 0: parts must be more than 0 and at most 100')
+
+    def test_reject_name_and_color(self):
+        self.assertRejected(dict(self.ingredient, name=' \n'), 'ingredient 0: name must be 1 to 80 characters')
+        self.assertRejected(dict(self.ingredient, name='m' * 81), 'ingredient 0: name must be 1 to 80 characters')
+        self.assertRejected(dict(self.ingredient, name=1), 'ingredient 0: name must be a string')
+        self.assertRejected(dict(self.ingredient, color=None), 'ingredient 0: color must be a string')
+
+
+class CoffeeShopTestCase(unittest.TestCase):
+    """This class represents the coffee shop api test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.app = app
+        self.client = self.app.test_client
+        self.headers = {'Authorization': 'Bearer test'}
+        self.payload = {'permissions': ['get:drinks-detail', 'post:drinks', 'patch:drinks', 'delete:drinks']}
+        # every token is accepted, with the permissions of self.payload
+        patcher = mock.patch('src.auth.auth.verify_decode_jwt', side_effect=lambda token: self.payload)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.app.app_context():
+            db_drop_and_create_all()
+            Drink(title='Water', recipe={'name': 'water', 'color': 'blue', 'parts': 1}).insert()
+            # the menu served is rebuilt from this database, not the last test's
+            menu.publish()
+
+        self.new_drink = {
+            'title': 'Latte',
+            'recipe': [{'name': 'milk', 'color': 'grey', 'parts': 3.0},
+                       {'name': 'espresso', 'color': 'Brown', 'parts': 1}]
+        }
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with self.app.app_context():
+            db.session.remove()
+
+    def test_create_drink_canonical_recipe(self):
+        res = self.client().post('/drinks', json=self.new_drink, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['drinks']['recipe'], [{'name': 'milk', 'color': 'grey', 'parts': 3},
+                                                    {'name': 'espresso', 'color': 'brown', 'parts': 1}])
+
+    def test_422_create_drink_invalid_recipe(self):
+        recipe = [{'name': 'milk', 'color': 'grey', 'parts': True}]
+        res = self.client().post('/drinks', json={'title': 'Latte', 'recipe': recipe}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'ingredient 0: parts must be a number')
+        with self.app.app_context():
+            self.assertEqual(Drink.query.count(), 1)
+
+    def test_422_update_drink_invalid_recipe(self):
+        res = self.client().patch('/drinks/1', json={'recipe': []}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'recipe must have 1 to 20 ingredients')
+        with self.app.app_context():
+            self.assertEqual(Drink.query.get(1).long()['recipe'], [{'name': 'water', 'color': 'blue', 'parts': 1}])
+
+    def test_304_for_matching_etag(self):
+        res = self.client().get('/drinks')
+        etag = res.headers['ETag']
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['drinks'][0]['title'], 'Water')
+
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        self.client().post('/drinks', json=self.new_drink, headers=self.headers)
+        res = self.client().get('/drinks', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def drinks_with(self, ingredient):
+        res = self.client().get('/drinks', query_string={'ingredient': ingredient})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        return [drink['title'] for drink in data['drinks']]
+
+    def test_drinks_by_ingredient(self):
+        self.client().post('/drinks', json=self.new_drink, headers=self.headers)
+
+        self.assertEqual(self.drinks_with('milk'), ['Latte'])
+        self.assertEqual(self.drinks_with('  ESPRESSO '), ['Latte'])
+        self.assertEqual(self.drinks_with('water'), ['Water'])
+        self.assertEqual(self.drinks_with('sugar'), [])
+
+    def test_update_reindexes_ingredients(self):
+        self.client().post('/drinks', json=self.new_drink, headers=self.headers)
+        recipe = [{'name': 'Oat milk', 'color': 'white', 'parts': 3}, {'name': 'espresso', 'color': 'brown', 'parts': 1}]
+        res = self.client().patch('/drinks/2', json={'recipe': recipe}, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.drinks_with('milk'), [])
+        self.assertEqual(self.drinks_with('oat milk'), ['Latte'])
+        self.assertEqual(self.drinks_with('espresso'), ['Latte'])
+
+    def test_delete_removes_ingredients(self):
+        self.client().post('/drinks', json=self.new_drink, headers=self.headers)
+        res = self.client().delete('/drinks/2', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.drinks_with('milk'), [])
+        with self.app.app_context():
+            self.assertEqual([row.name for row in Ingredient.query.all()], ['water'])
+
+    def test_400_batch_malformed_operation(self):
+        for operation in ({'op': ['delete'], 'id': 1}, {'op': {'delete': 1}, 'id': 1}, {'op': 'drop', 'id': 1},
+                          {'op': 'delete', 'id': [1]}, {'op': 'delete', 'id': '1'}, {'op': 'update', 'id': True},
+                          {'op': 'update'}, 'delete'):
+            res = self.client().post('/drinks/batch', json={'operations': [operation]}, headers=self.headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], 'Bad request')
+
+        for body in ([{'op': 'create'}], 'create', 1, None, {'operations': []}, {'operations': {'op': 'create'}}):
+            res = self.client().post('/drinks/batch', json=body, headers=self.headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    def test_batch(self):
+        operations = [dict(self.new_drink, op='create'), {'op': 'update', 'id': 1, 'title': 'Still water'}]
+        res = self.client().post('/drinks/batch', json={'operations': operations}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([result['drinks'][0]['title'] for result in data['results']], ['Latte', 'Still water'])
+
+    def test_batch_failure_rolls_back_earlier_operations(self):
+        operations = [dict(self.new_drink, op='create'),
+                      {'op': 'update', 'id': 1, 'title': 'Still water'},
+                      {'op': 'delete', 'id': 1},
+                      {'op': 'update', 'id': 99, 'title': 'Ghost'}]
+        res = self.client().post('/drinks/batch', json={'operations': operations}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['results'][3], {'success': False, 'error': 404, 'message': 'Resource not found'})
+        self.assertTrue(all(result.get('skipped') for result in data['results'][:3]))
+        with self.app.app_context():
+            self.assertEqual([drink.title for drink in Drink.query.all()], ['Water'])
+
+    def test_403_batch_operation_not_permitted(self):
+        self.payload = {'permissions': ['post:drinks']}
+        operations = [dict(self.new_drink, op='create'), {'op': 'delete', 'id': 1}]
+        res = self.client().post('/drinks/batch', json={'operations': operations}, headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['results'][1]['error'], 403)
+        with self.app.app_context():
+            self.assertEqual(Drink.query.count(), 1)
+
+
+
+class MenuSnapshotsTestCase(unittest.TestCase):
+    """This class represents the menu snapshot cache test case"""
+
+    def setUp(self):
+        """Define test variables."""
+        directory = tempfile.mkdtemp()
+        self.version_path = os.path.join(directory, 'menu.version')
+        self.snapshot_path = os.path.join(directory, 'menu.snapshot')
+        self.titles = ['Water']
+
+    def load(self):
+        drinks = [{'id': n, 'title': title, 'recipe': []} for n, title in enumerate(self.titles, 1)]
+        return drinks, drinks
+
+    def snapshots(self):
+        return MenuSnapshots(self.version_path, self.snapshot_path, mock.Mock(side_effect=self.load))
+
+    def titles_in(self, snapshot):
+        return [drink['title'] for drink in json.loads(snapshot.short_body)['drinks']]
+
+    def test_current_is_reused_until_published(self):
+        menu = self.snapshots()
+        menu.publish()
+
+        self.assertIs(menu.current(), menu.current())
+        self.assertEqual(menu.load.call_count, 1)
+
+    def test_publish_in_another_process_makes_snapshot_stale(self):
+        first, second = self.snapshots(), self.snapshots()
+        first.publish()
+        held = second.current()
+        self.assertEqual(self.titles_in(held), ['Water'])
+
+        self.titles.append('Latte')
+        first.publish()
+
+        current = second.current()
+        self.assertNotEqual(current.version, held.version)
+        self.assertEqual(self.titles_in(current), ['Water', 'Latte'])
+        self.assertNotEqual(current.short_etag, held.short_etag)
+
+    def test_restarted_instance_reads_snapshot_from_disk(self):
+        self.snapshots().publish()
+
+        restarted = self.snapshots()
+        snapshot = restarted.current()
+
+        self.assertEqual(self.titles_in(snapshot), ['Water'])
+        self.assertEqual(snapshot.drinks[0].title, 'Water')
+        restarted.load.assert_not_called()
+        self.assertEqual(restarted.builds, 0)
+
+
+class DrinkProjectionTestCase(unittest.TestCase):
+    """This class represents the memoized drink projections test case"""
+
+    def setUp(self):
+        """Initialize app and a drink."""
+        self.context = app.app_context()
+        self.context.push()
+        db_drop_and_create_all()
+        self.drink = Drink(title='Water', recipe={'name': 'water', 'color': 'blue', 'parts': 1})
+        self.drink.insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        self.context.pop()
+
+    def test_projections_are_reused(self):
+        self.assertIs(self.drink.short(), self.drink.short())
+        self.assertIs(self.drink.long(), self.drink.long())
+
+    def test_assignment_rebuilds_projections(self):
+        short, long = self.drink.short(), self.drink.long()
+
+        self.drink.title = 'Sparkling water'
+        self.assertEqual(self.drink.short()['title'], 'Sparkling water')
+        self.assertEqual(self.drink.long()['title'], 'Sparkling water')
+        self.drink.recipe = [{'name': 'water', 'color': 'clear', 'parts': 2}]
+        self.assertEqual(self.drink.short()['recipe'], [{'color': 'clear', 'parts': 2}])
+        self.assertEqual(self.drink.long()['recipe'], [{'name': 'water', 'color': 'clear', 'parts': 2}])
+        # the old ones, which may have been handed out, are left as they were
+        self.assertEqual(short['title'], 'Water')
+        self.assertEqual(long['recipe'], [{'name': 'water', 'color': 'blue', 'parts': 1}])
+
+    def test_commit_and_refresh_rebuild_projections(self):
+        self.drink.short()
+        db.session.execute(Drink.__table__.update().values(title='Tap water'))
+        db.session.commit()
+        self.assertEqual(self.drink.short()['title'], 'Tap water')
+
+        db.session.execute(Drink.__table__.update().values(title='Still water'))
+        db.session.refresh(self.drink)
+        self.assertEqual(self.drink.long()['title'], 'Still water')
+
+    def test_update_keeps_projections_current(self):
+        self.drink.title = 'Sparkling water'
+        self.drink.update()
+
+        self.assertEqual(self.drink.short()['title'], 'Sparkling water')
+        self.assertEqual(Drink.query.get(self.drink.id).long()['title'], 'Sparkling water')
+
+
+class OrderWriterTestCase(unittest.TestCase):
+    """This class represents the order writer test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        with app.app_context():
+            db_drop_and_create_all()
+        self.writer = OrderWriter(app, interval=0.01, batch_size=10, backoff=0.01)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        with app.app_context():
+            db.session.remove()
+
+    def order(self, order_id, status='queued'):
+        now = time.time()
+        return {'id': order_id, 'drinks': [1], 'priority': 0, 'status': status, 'station': None,
+                'created_at': now, 'updated_at': now}
+
+    def written(self):
+        with app.app_context():
+            return {order.id: order.status for order in Order.query.all()}
+
+    def test_failed_write_is_retried(self):
+        execute = self.writer._execute
+        attempts = []
+
+        def flaky(batch):
+            attempts.append(batch)
+            if len(attempts) <= 2:
+                raise OperationalError('INSERT', {}, Exception('database is locked'))
+            execute(batch)
+
+        with mock.patch.object(self.writer, '_execute', side_effect=flaky):
+            self.writer.start()
+            self.writer.insert(self.order('a' * 32))
+            self.writer.update(dict(self.order('a' * 32), status='ready'))
+            self.writer.stop()
+
+        self.assertEqual(self.written(), {'a' * 32: 'ready'})
+        self.assertEqual(self.writer.retries, 2)
+        self.assertEqual(self.writer.failed, 0)
+
+    def test_rejected_change_loses_only_itself(self):
+        self.writer.start()
+        self.writer.insert(self.order('a' * 32))
+        self.writer.insert(dict(self.order('b' * 32), status=None))
+        self.writer.insert(self.order('c' * 32))
+        self.writer.stop()
+
+        self.assertEqual(self.written(), {'a' * 32: 'queued', 'c' * 32: 'queued'})
+        self.assertEqual(self.writer.failed, 1)
+
+    def test_gives_up_while_stopping(self):
+        outage = OperationalError('INSERT', {}, Exception('database is locked'))
+        with mock.patch.object(self.writer, '_execute', side_effect=outage):
+            self.writer.start()
+            self.writer.insert(self.order('a' * 32))
+            self.writer.stop()
+
+        self.assertEqual(self.writer.failed, 1)
+        self.assertEqual(self.written(), {})
+
+
+
+class MenuStreamTestCase(unittest.TestCase):
+    """This class represents the menu change stream test case"""
+
+    def setUp(self):
+        """Define test variables and initialize the event table."""
+        directory = tempfile.mkdtemp()
+        self.database_path = os.path.join(directory, 'database.db')
+        self.version_path = os.path.join(directory, 'menu.version')
+        self.execute('CREATE TABLE menu_event (id INTEGER PRIMARY KEY, kind VARCHAR(8) NOT NULL, '
+                     'drink_id INTEGER NOT NULL, drink JSON)')
+        self.stream = MenuStream(self.database_path, self.version_path, poll_interval=0.01)
+
+    def execute(self, sql, parameters=()):
+        connection = sqlite3.connect(self.database_path)
+        with connection:
+            connection.execute(sql, parameters)
+        connection.close()
+
+    def change(self, kind, drink_id, title):
+        self.execute('INSERT INTO menu_event (kind, drink_id, drink) VALUES (?, ?, ?)',
+                     (kind, drink_id, json.dumps({'id': drink_id, 'title': title, 'recipe': []})))
+        # replaced like MenuSnapshots.publish() does, so the version changes
+        with open(self.version_path + '.new', 'w') as f:
+            f.write(title)
+        os.replace(self.version_path + '.new', self.version_path)
+
+    def publish(self, first, last):
+        for event_id in range(first, last + 1):
+            self.stream.publish(event_id, 'message {}'.format(event_id).encode())
+
+    def test_missed_events_are_replayed(self):
+        self.publish(1, 5)
+
+        self.assertEqual(self.stream.missed('3'), [b'message 4', b'message 5'])
+        self.assertEqual(self.stream.missed('0'), ['message {}'.format(n).encode() for n in range(1, 6)])
+        self.assertEqual(self.stream.missed('5'), [])
+
+    def test_reset_when_missed_events_are_unknown(self):
+        self.publish(1, BACKLOG + 10)
+
+        self.assertIsNone(self.stream.missed(None))
+        self.assertIsNone(self.stream.missed('not a number'))
+        self.assertIsNone(self.stream.missed('5'))
+        self.assertIsNone(self.stream.missed(str(BACKLOG + 11)))
+        self.assertEqual(self.stream.missed(str(BACKLOG + 7)),
+                         ['message {}'.format(n).encode() for n in range(BACKLOG + 8, BACKLOG + 11)])
+
+    def test_ids_going_backwards_reset_the_stream(self):
+        # published before the database was recreated
+        self.publish(1, 10)
+        subscriber = asyncio.Queue()
+        self.stream.subscribers[subscriber] = None
+        self.change('create', 1, 'Latte')
+
+        asyncio.run(self.stream.catch_up())
+
+        self.assertEqual(self.stream.last_id, 1)
+        self.assertEqual(subscriber.get_nowait(), RESET)
+        self.assertIn(b'event: create', subscriber.get_nowait())
+        self.assertIsNone(self.stream.missed('10'))
+
+    def test_stream_over_http(self):
+        async def read_event(reader):
+            return (await asyncio.wait_for(reader.readuntil(b'\n\n'), 5)).decode()
+
+        async def connect(port, headers=''):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write('GET /drinks/stream HTTP/1.1\r\nHost: localhost\r\n{}\r\n'.format(headers).encode())
+            head = await asyncio.wait_for(reader.readuntil(b'retry: 5000\n\n'), 5)
+            self.assertTrue(head.startswith(b'HTTP/1.1 200 OK\r\n'))
+            return reader, writer
+
+        async def scenario():
+            server = await asyncio.start_server(self.stream.handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            poll = asyncio.ensure_future(self.stream.poll())
+            try:
+                reader, writer = await connect(port)
+                self.assertIn('event: reset', await read_event(reader))
+                await asyncio.sleep(0.05)
+                self.change('create', 1, 'Latte')
+                created = await read_event(reader)
+                self.assertIn('event: create', created)
+                self.assertIn('"title": "Latte"', created)
+                writer.close()
+
+                self.change('update', 1, 'Flat white')
+                reader, writer = await connect(port, 'Last-Event-ID: 1\r\n')
+                self.assertIn('"title": "Flat white"', await read_event(reader))
+                writer.close()
+
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b'GET /drinks HTTP/1.1\r\n\r\n')
+                self.assertTrue((await reader.read()).startswith(b'HTTP/1.1 404 Not Found'))
+                writer.close()
+            finally:
+                poll.cancel()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(scenario())
+
+
+
+class InventoryTestCase(unittest.TestCase):
+    """This class represents the ingredient consumption and forecast test case"""
+
+    def setUp(self):
+        """Define test variables."""
+        self.now = 1000000.0
+        self.matrix = MenuMatrix.compile([(2, 'milk', 1), (1, 'espresso', 1), (2, 'espresso', 2), (2, 'milk', 0.5)])
+        self.stock = [('milk', 10.0, self.now - 7200), ('sugar', 5.0, self.now - 7200)]
+        # drink 99 is no longer on the menu
+        self.orders = [(self.now - 5000, [2]), (self.now - 100, [2, 2]), (self.now - 50, [99])]
+
+    def test_compile(self):
+        self.assertEqual(self.matrix.drink_ids.tolist(), [1, 2])
+        self.assertEqual(self.matrix.ingredients, ('espresso', 'milk'))
+        self.assertEqual(self.matrix.parts.tolist(), [[1.0, 0.0], [2.0, 1.5]])
+
+    def test_counts_and_consumption_ignore_drinks_off_the_menu(self):
+        self.assertEqual(self.matrix.counts([2, 2, 1, 99, 0]).tolist(), [1.0, 2.0])
+        self.assertEqual(self.matrix.consumption([2, 1, 99]).tolist(), [3.0, 1.5])
+        self.assertEqual(self.matrix.consumption([]).tolist(), [0.0, 0.0])
+
+    def test_empty_menu(self):
+        matrix = MenuMatrix.compile([])
+
+        self.assertEqual(matrix.counts([1, 2]).tolist(), [])
+        self.assertEqual(matrix.consumption([1, 2]).tolist(), [])
+        results = forecast(matrix, self.stock, self.orders, self.now, 3600, 86400)
+        self.assertEqual([(result['name'], result['remaining'], result['depletes_at']) for result in results],
+                         [('milk', 10.0, None), ('sugar', 5.0, None)])
+
+    def test_forecast(self):
+        milk, sugar = forecast(self.matrix, self.stock, self.orders, self.now, 3600, 86400)
+
+        self.assertEqual(milk['name'], 'milk')
+        self.assertEqual(milk['remaining'], 5.5)
+        self.assertAlmostEqual(milk['per_hour'], 3.0)
+        self.assertAlmostEqual(milk['depletes_at'], self.now + 6600)
+        self.assertEqual(milk['stale'], False)
+        # counted, but in no recipe
+        self.assertEqual((sugar['name'], sugar['remaining'], sugar['per_hour'], sugar['depletes_at']),
+                         ('sugar', 5.0, 0.0, None))
+
+    def test_old_counts_are_capped_and_stale(self):
+        self.assertEqual(forecast_since(self.stock, self.now, 3600, 86400), self.now - 7200)
+        self.assertEqual(forecast_since(self.stock, self.now, 3600, 1000), self.now - 1000)
+
+        milk, _ = forecast(self.matrix, self.stock, self.orders, self.now, 3600, 1000)
+        self.assertEqual(milk['remaining'], 7.0)
+        self.assertEqual(milk['stale'], True)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()